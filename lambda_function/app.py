@@ -1,16 +1,26 @@
 import logging
+import os
 
 from aws.resources.handler import ResourcesHandler
 from config import get_config
+from observability import metrics
 
 logger = logging.getLogger()
-logger.setLevel(logging.INFO)
+logger.setLevel(os.environ.get("LOG_LEVEL", "INFO"))
 
 
 def lambda_handler(event, context):
-    logger.info("Load config")
-    config = get_config(event, context)
-    logger.info("Handling resources")
-    resources_handler = ResourcesHandler(config, context)
-    resources_handler.handle()
-    logger.info("Exiting...")
+    metrics.set_default_dimensions(FunctionName=context.function_name)
+    try:
+        logger.info("Load config")
+        with metrics.timer("StageDuration", Stage="load_config"):
+            config = get_config(event, context)
+        logger.info("Handling resources")
+        resources_handler = ResourcesHandler(config, context)
+        response = resources_handler.handle()
+        logger.info("Exiting...")
+        return response  # Partial batch failures of SQS events
+    finally:
+        # Time left of the Lambda timeout, how close the run got to it
+        metrics.put("RemainingTimeMargin", context.get_remaining_time_in_millis())
+        metrics.flush()
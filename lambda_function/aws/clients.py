@@ -0,0 +1,62 @@
+import threading
+import time
+
+import consts
+from aws.rate_limiter import register_rate_limiter
+from observability import metrics
+
+# boto3 sessions aren't thread safe, clients are. So clients are created once under a lock and shared between threads
+_session = None
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_session():
+    # boto3 is imported on first use, it takes a good part of the cold start
+    global _session
+    if _session is None:
+        with _clients_lock:
+            if _session is None:
+                import boto3
+                _session = boto3.session.Session()
+    return _session
+
+
+def get_client(service_name, region_name=None):
+    session = get_session()
+    region_name = region_name or session.region_name
+    credentials = session.get_credentials()
+    client_key = (service_name, region_name, credentials.access_key if credentials else None)
+    client = _clients.get(client_key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(client_key)
+            if client is None:
+                from botocore.config import Config
+                client = session.client(service_name, region_name=region_name, config=Config(
+                    max_pool_connections=max(consts.MAX_DEFAULT_AWS_WORKERS, consts.PIPELINE_FETCH_WORKERS),
+                ))
+                register_rate_limiter(client, service_name, region_name)
+                _register_metrics(client, service_name, region_name)
+                _clients[client_key] = client
+    return client
+
+
+def _register_metrics(client, service_name, region_name):
+    # Latency of every call as seen by the exporter, rate limiter waits and retries included
+    def before_parameter_build(model, context, **kwargs):
+        context["metrics_start"] = time.monotonic()
+        context["metrics_operation"] = model.name
+
+    def after_call(context, parsed=None, exception=None, **kwargs):
+        if "metrics_start" not in context:
+            return
+        dimensions = {"Service": service_name, "Region": region_name, "Operation": context["metrics_operation"]}
+        metrics.put("AwsCallLatency", (time.monotonic() - context["metrics_start"]) * 1000, **dimensions)
+        if exception is not None or (parsed or {}).get("Error"):
+            metrics.increment("AwsCallErrors", **dimensions)
+
+    service_event_name = client.meta.service_model.service_id.hyphenize()
+    client.meta.events.register(f"before-parameter-build.{service_event_name}", before_parameter_build)
+    client.meta.events.register(f"after-call.{service_event_name}", after_call)
+    client.meta.events.register(f"after-call-error.{service_event_name}", after_call)
@@ -0,0 +1,96 @@
+import logging
+import threading
+import time
+
+import consts
+from observability import metrics
+
+logger = logging.getLogger(__name__)
+
+THROTTLING_ERROR_CODES = {"Throttling", "ThrottlingException", "ThrottledException", "RequestThrottledException",
+                          "TooManyRequestsException", "RequestLimitExceeded", "RequestLimitExceededException",
+                          "SlowDown"}
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+
+class AdaptiveRateLimiter:
+    # Token bucket whose rate is tuned with AIMD: it grows additively while calls succeed and is halved on throttling
+    def __init__(self, name, initial_rate, min_rate, max_rate):
+        self.name = name
+        self.rate = initial_rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self._tokens = 1.0
+        self._last_refill = time.monotonic()
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait_seconds = (1 - self._tokens) / self.rate
+            time.sleep(wait_seconds)
+
+    def on_success(self):
+        with self._lock:
+            # Grows by AWS_RATE_LIMIT_INCREASE calls per second for every second of successful calls
+            self.rate = min(self.max_rate, self.rate + consts.AWS_RATE_LIMIT_INCREASE / self.rate)
+
+    def on_throttle(self):
+        with self._lock:
+            now = time.monotonic()
+            # Calls sent before the last decrease are throttled too, they shouldn't lower the rate again
+            if now - self._last_decrease < consts.AWS_RATE_LIMIT_DECREASE_COOLDOWN_SECONDS:
+                return
+            self._last_decrease = now
+            self.rate = max(self.min_rate, self.rate * consts.AWS_RATE_LIMIT_DECREASE_FACTOR)
+            self._tokens = min(self._tokens, 0.0)
+        logger.info(f"Throttled by AWS, {self.name} rate lowered to {self.rate:.2f} calls per second")
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(max(1.0, self.rate), self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+
+def get_rate_limiter(service_name, region_name):
+    limiter_key = (service_name, region_name)
+    with _rate_limiters_lock:
+        rate_limiter = _rate_limiters.get(limiter_key)
+        if rate_limiter is None:
+            initial_rate = consts.AWS_RATE_LIMIT_INITIAL_RATES.get(service_name, consts.AWS_RATE_LIMIT_INITIAL_RATE)
+            rate_limiter = AdaptiveRateLimiter(f"{service_name} in {region_name}", initial_rate=initial_rate,
+                                               min_rate=consts.AWS_RATE_LIMIT_MIN_RATE,
+                                               max_rate=consts.AWS_RATE_LIMIT_MAX_RATE)
+            _rate_limiters[limiter_key] = rate_limiter
+        return rate_limiter
+
+
+def register_rate_limiter(client, service_name, region_name):
+    rate_limiter = get_rate_limiter(service_name, region_name)
+
+    def before_send(**kwargs):
+        # Emitted for every attempt, so botocore retries wait for the limiter too
+        rate_limiter.acquire()
+
+    def needs_retry(response=None, caught_exception=None, **kwargs):
+        if response is None:
+            return None
+        error_code = response[1].get("Error", {}).get("Code")
+        if error_code in THROTTLING_ERROR_CODES:
+            metrics.increment("AwsThrottles", Service=service_name, Region=region_name)
+            rate_limiter.on_throttle()
+        elif not error_code:
+            rate_limiter.on_success()
+        return None
+
+    service_event_name = client.meta.service_model.service_id.hyphenize()
+    client.meta.events.register(f"before-send.{service_event_name}", before_send)
+    # Registered first, as the emit stops at botocore's retry handler once it decides to retry
+    client.meta.events.register_first(f"needs-retry.{service_event_name}", needs_retry)
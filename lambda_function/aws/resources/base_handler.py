@@ -1,20 +1,31 @@
 import copy
 import json
 import logging
+import threading
+import time
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
-import boto3
-
 import consts
-from port.entities import create_entities_json
+from aws.resources.time_budget import TimeBudget
+from observability import metrics
+from port.entities import compile_entities_jq_queries, get_entities_jq_queries, get_jq_queries_referenced_keys
 
 logger = logging.getLogger(__name__)
 
+# Caps the regions (and CloudControl resource models) listed concurrently, across all handlers
+traversals_semaphore = threading.BoundedSemaphore(consts.MAX_CONCURRENT_TRAVERSALS)
+
 
 class BaseHandler:
-    def __init__(self, resource_config, port_client, lambda_context, default_region):
+    # AWS service the handler lists resources from, kinds of the same service are synced one at a time
+    AWS_SERVICE = "cloudcontrol"
+    # Keys the handler adds to the resource with extra AWS calls, mapped to the call that fetches them
+    ENRICHMENTS = {}
+
+    def __init__(self, resource_config, port_client, lambda_context, default_region, pipeline=None):
         self.resource_config = copy.deepcopy(resource_config)
         self.port_client = port_client
+        self.pipeline = pipeline
         self.lambda_context = lambda_context
         self.kind = self.resource_config.get("kind", "")
         selector = self.resource_config.get("selector", {})
@@ -22,16 +33,168 @@ class BaseHandler:
         self.selector_aws = selector.get("aws", {})
         self.regions = self.selector_aws.get("regions", [default_region])
         self.regions_config = self.selector_aws.get("regions_config", {})
-        self.next_token = self.selector_aws.get("next_token", "")
         self.mappings = (self.resource_config.get("port", {}).get("entity", {}).get("mappings", []))
+        compile_entities_jq_queries(self.selector_query, self.mappings)
+        self.enrichments = self._get_required_enrichments()
         self.aws_entities = set()
         self.skip_delete = False
+        self._lock = threading.Lock()
+        self.time_budget = TimeBudget(lambda_context)
+
+        next_token = self.selector_aws.pop("next_token", None)
+        traversals = self._get_traversals()
+        if next_token and traversals:  # Checkpoints of previous versions hold a single token, of the first traversal
+            self._set_next_token(*traversals[0], next_token)
 
     def handle(self):
-        raise NotImplementedError("Subclasses should implement 'handle' function")
+        traversals = self._get_traversals()
+        if traversals:
+            with ThreadPoolExecutor(max_workers=min(len(traversals), consts.MAX_CONCURRENT_TRAVERSALS)) as executor:
+                futures = [executor.submit(self._handle_traversal, region, resource_model)
+                           for region, resource_model in traversals]
+                for completed_future in as_completed(futures):
+                    completed_future.result()
+
+        if not self.regions:  # Nothing left to sync
+            return {"aws_entities": self.aws_entities, "next_resource_config": None, "skip_delete": self.skip_delete}
+
+        # Lambda timeout is too close, should return checkpoint for next run
+        return self._handle_close_to_timeout()
+
+    def _handle_close_to_timeout(self):
+        # Unfinished regions keep their own next token and page offset (per resource model for CloudControl) to resume from
+        self.selector_aws["regions"] = self.regions
+        self.selector_aws["regions_config"] = self.regions_config
+        if "selector" not in self.resource_config:
+            self.resource_config["selector"] = {}
+        self.resource_config["selector"]["aws"] = self.selector_aws
+
+        return {"aws_entities": self.aws_entities, "next_resource_config": self.resource_config, "skip_delete": self.skip_delete}
+
+    def _list_resources(self, region, next_token, resource_model=None):
+        raise NotImplementedError("Subclasses should implement '_list_resources' function")
+
+    def _get_listed_resources(self, list_response, region):
+        # Resources of a listed page, as (resource id, resource object or None to describe it on its own) pairs
+        raise NotImplementedError("Subclasses should implement '_get_listed_resources' function")
+
+    def fetch_resource(self, region, resource_id, action_type="upsert", resource_obj=None):
+        raise NotImplementedError("Subclasses should implement 'fetch_resource' function")
+
+    def handle_single_resource_item(self, region, resource_id, action_type="upsert", resource_obj=None):
+        return self.pipeline.submit(self, region, resource_id, action_type, resource_obj).result()
+
+    def _handle_resources(self, region, resources):
+        futures = [self.pipeline.submit(self, region, resource_id, "upsert", resource_obj)
+                   for resource_id, resource_obj in resources]
+        for future in futures:
+            self._update_result(future.result())
+
+    def _get_traversals(self):
+        return [(region, None) for region in self.regions]
+
+    def _handle_traversal(self, region, resource_model=None):
+        with traversals_semaphore:
+            next_token = self._get_next_token(region, resource_model)
+            if next_token is not None and self.time_budget.has_time_for_page():
+                logger.info(f"List kind: {self.kind}, region: {region}"
+                            + (f", resource_model: {resource_model}" if resource_model else ""))
+
+            while next_token is not None and self.time_budget.has_time_for_page():
+                start = time.monotonic()
+                try:
+                    response, page_next_token = self._list_resources(region, next_token, resource_model)
+                except Exception as e:
+                    logger.error(f"Failed to list kind: {self.kind}, region: {region}"
+                                 + (f", resource_model: {resource_model}" if resource_model else "") + f"; {e}")
+                    self._update_result({"skip_delete": True})
+                    next_token = None
+                    break
+                self.time_budget.record_page((time.monotonic() - start) * 1000)
+
+                resources = self._get_listed_resources(response, region)
+                offset = self._handle_page_resources(region, resources,
+                                                     self._get_page_offset(region, resource_model, resources))
+                if offset < len(resources):
+                    # Out of time mid page, the next run lists the page again with the same token and resumes it
+                    self._set_page_offset(region, resource_model,
+                                          {"offset": offset, "identifier": resources[offset - 1][0]} if offset else None)
+                    metrics.increment("MidPageCheckpoints", Kind=self.kind)
+                    break
+
+                next_token = page_next_token
+                self._set_page_offset(region, resource_model, None)
+                self._set_next_token(region, resource_model, next_token)
+
+            if next_token is None:
+                self._complete_traversal(region, resource_model)
+
+    def _handle_page_resources(self, region, resources, offset):
+        # Handled in chunks that fit the time left, returns the offset of the first resource that wasn't handled.
+        # A chunk takes half of the affordable resources, so the estimates are refreshed as the deadline gets closer
+        while offset < len(resources):
+            chunk_size = min(len(resources) - offset, self.time_budget.get_affordable_items() // 2)
+            if chunk_size < 1:
+                break
+
+            start = time.monotonic()
+            self._handle_resources(region, resources[offset:offset + chunk_size])
+            self.time_budget.record_items(chunk_size, (time.monotonic() - start) * 1000)
+            offset += chunk_size
+        return offset
+
+    def _get_page_offset(self, region, resource_model, resources):
+        page_offset = self.regions_config.get(region, {}).get("page_offsets", {}).get(resource_model or "")
+        if not page_offset:
+            return 0
+
+        offset = page_offset["offset"]
+        if offset > len(resources) or resources[offset - 1][0] != page_offset["identifier"]:
+            # Resources were added or removed since the checkpoint, the whole page is handled again
+            logger.warning(f"Page of kind: {self.kind}, region: {region} changed since it was checkpointed,"
+                           f" handling it from the start")
+            return 0
+        return offset
+
+    def _set_page_offset(self, region, resource_model, page_offset):
+        with self._lock:
+            if page_offset:
+                self.regions_config.setdefault(region, {}).setdefault("page_offsets", {})[resource_model or ""] = page_offset
+            else:
+                self.regions_config.get(region, {}).get("page_offsets", {}).pop(resource_model or "", None)
+
+    def _get_next_token(self, region, resource_model=None):
+        return self.regions_config.get(region, {}).get("next_token", "")
+
+    def _set_next_token(self, region, resource_model, next_token):
+        with self._lock:
+            region_config = self.regions_config.setdefault(region, {})
+            if next_token:
+                region_config["next_token"] = next_token
+            else:
+                region_config.pop("next_token", None)
+
+    def _complete_traversal(self, region, resource_model=None):
+        with self._lock:
+            self._cleanup_regions(region)
+
+    def _update_result(self, result):
+        with self._lock:
+            self.aws_entities.update(result.get("aws_entities", set()))
+            self.skip_delete = result.get("skip_delete", False) if not self.skip_delete else self.skip_delete
+
+    def _get_required_enrichments(self):
+        if not self.ENRICHMENTS or not self.selector_aws.get("lazy_enrichment", True):
+            return dict(self.ENRICHMENTS)
+        referenced_keys = get_jq_queries_referenced_keys(get_entities_jq_queries(self.selector_query, self.mappings))
+        if referenced_keys is None:
+            return dict(self.ENRICHMENTS)
 
-    def handle_single_resource_item(self, region, resource_id, action_type="upsert"):
-        raise NotImplementedError("Subclasses should implement 'handle_single_resource_item' function")
+        enrichments = {key: call for key, call in self.ENRICHMENTS.items() if key in referenced_keys}
+        for key, call in self.ENRICHMENTS.items():
+            if key not in enrichments:
+                logger.info(f"Skipping {call} for kind: {self.kind}, {key} isn't used by the selector and mappings")
+        return enrichments
 
     def _cleanup_regions(self, region):
         self.regions.remove(region)
@@ -1,103 +1,90 @@
-import copy
 import json
 import logging
-from concurrent.futures import ThreadPoolExecutor, as_completed
 
-import boto3
-import consts
+from aws.clients import get_client
 from aws.resources.base_handler import BaseHandler
-from port.entities import create_entities_json, handle_entities
+from observability import log_sampled_debug, metrics
+from port.entities import get_entities_jq_queries, get_jq_queries_top_level_keys
 
 logger = logging.getLogger(__name__)
 
 
 class CloudControlHandler(BaseHandler):
-    def handle(self):
-        for region in list(self.regions):
-            aws_cloudcontrol_client = boto3.client("cloudcontrol", region_name=region)
-            resources_models = self.regions_config.get(region, {}).get("resources_models", ["{}"])
-            for resource_model in list(resources_models):
-                logger.info(f"List kind: {self.kind}, region: {region}, resource_model: {resource_model}")
-                self.next_token = "" if self.next_token is None else self.next_token
-                while self.next_token is not None:
-                    list_resources_params = {
-                        "TypeName": self.kind,
-                        "ResourceModel": resource_model,
-                    }
-                    if self.next_token:
-                        list_resources_params["NextToken"] = self.next_token
-
-                    try:
-                        response = aws_cloudcontrol_client.list_resources(**list_resources_params)
-                    except Exception as e:
-                        logger.error(f"Failed list kind: {self.kind}, region: {region}, resource_model: {resource_model}; {e}")
-                        self.skip_delete = True
-                        self.next_token = None
-                        break
-
-                    self._handle_list_response(response, region)
-
-                    self.next_token = response.get("NextToken")
-                    if self.lambda_context.get_remaining_time_in_millis() < consts.REMAINING_TIME_TO_REINVOKE_THRESHOLD:
-                        # Lambda timeout is too close, should return checkpoint for next run
-                        return self._handle_close_to_timeout(resources_models, resource_model, region)
-
-                self._cleanup_resources_models(resources_models, resource_model, region)
-
-            self._cleanup_regions(region)
-
-        return {"aws_entities": self.aws_entities, "next_resource_config": None, "skip_delete": self.skip_delete}
-
-    def _handle_list_response(self, list_response, region):
-        resource_descriptions = list_response.get("ResourceDescriptions", [])
-        with ThreadPoolExecutor(max_workers=consts.MAX_CC_WORKERS) as executor:
-            futures = [executor.submit(self.handle_single_resource_item, region, resource_desc.get("Identifier", "")) for resource_desc in resource_descriptions]
-            for completed_future in as_completed(futures):
-                result = completed_future.result()
-                self.aws_entities.update(result.get("aws_entities", set()))
-                self.skip_delete = result.get("skip_delete", False) if not self.skip_delete else self.skip_delete
-
-    def handle_single_resource_item(self, region, resource_id, action_type="upsert"):
-        entities = []
-        skip_delete = False
-        try:
-            resource_obj = {}
-            if action_type == "upsert":
-                logger.info(f"Get resource for kind: {self.kind}, resource id: {resource_id}")
-                aws_cloudcontrol_client = boto3.client("cloudcontrol", region_name=region)
-                resource_obj = json.loads(aws_cloudcontrol_client.get_resource(TypeName=self.kind, Identifier=resource_id).get("ResourceDescription").get("Properties"))
-            elif action_type == "delete":
-                resource_obj = {"identifier": resource_id}  # Entity identifier to delete
-            entities = create_entities_json(resource_obj, self.selector_query, self.mappings, action_type)
-        except Exception as e:
-            logger.error(f"Failed to extract or transform resource id: {resource_id}, kind: {self.kind}, error: {e}")
-            skip_delete = True
-
-        aws_entities = handle_entities(entities, self.port_client, action_type)
-
-        return {"aws_entities": aws_entities, "skip_delete": skip_delete}
-
-    def _handle_close_to_timeout(self, resources_models, current_resource_model, region):
-        if self.next_token:
-            self.selector_aws["next_token"] = self.next_token
-        else:
-            self.selector_aws.pop("next_token", None)
-            resources_models = self._cleanup_resources_models(resources_models, current_resource_model, region)
+    def __init__(self, resource_config, port_client, lambda_context, default_region, pipeline=None):
+        super().__init__(resource_config, port_client, lambda_context, default_region, pipeline)
+        # Listed resources hold some of their properties, "auto" uses them when they hold every key the selector and
+        # mappings read, "always" uses them anyway and "never" gets every resource on its own
+        self.list_properties = self.selector_aws.get("list_properties", "auto")
+        self.required_keys = self._get_required_keys() if self.list_properties == "auto" else None
+
+    def _get_traversals(self):
+        return [(region, resource_model) for region in self.regions
+                for resource_model in self.regions_config.get(region, {}).get("resources_models", ["{}"])]
+
+    def _list_resources(self, region, next_token, resource_model=None):
+        list_resources_params = {
+            "TypeName": self.kind,
+            "ResourceModel": resource_model,
+        }
+        if next_token:
+            list_resources_params["NextToken"] = next_token
+        response = get_client("cloudcontrol", region_name=region).list_resources(**list_resources_params)
+        return response, response.get("NextToken")
+
+    def _get_next_token(self, region, resource_model=None):
+        return self.regions_config.get(region, {}).get("next_tokens", {}).get(resource_model, "")
+
+    def _set_next_token(self, region, resource_model, next_token):
+        with self._lock:
+            next_tokens = self.regions_config.setdefault(region, {}).setdefault("next_tokens", {})
+            if next_token:
+                next_tokens[resource_model] = next_token
+            else:
+                next_tokens.pop(resource_model, None)
+
+    def _complete_traversal(self, region, resource_model=None):
+        with self._lock:
+            region_config = self.regions_config.setdefault(region, {})
+            resources_models = region_config.setdefault("resources_models", ["{}"])
+            resources_models.remove(resource_model)
+            region_config.get("next_tokens", {}).pop(resource_model, None)
             if not resources_models:
                 self._cleanup_regions(region)
-                if not self.regions:  # Nothing left to sync
-                    return {"aws_entities": self.aws_entities, "next_resource_config": None, "skip_delete": self.skip_delete}
 
-        if "selector" not in self.resource_config:
-            self.resource_config["selector"] = {}
-        self.resource_config["selector"]["aws"] = self.selector_aws
-
-        return {"aws_entities": self.aws_entities, "next_resource_config": self.resource_config, "skip_delete": self.skip_delete}
-
-    def _cleanup_resources_models(self, resources_models, current_resource_model, region):
-        resources_models.remove(current_resource_model)
-        if region not in self.regions_config:
-            self.regions_config[region] = {}
-        self.regions_config[region]["resources_models"] = resources_models
-        self.selector_aws["regions_config"] = self.regions_config
-        return resources_models
+    def _get_listed_resources(self, list_response, region):
+        resource_descriptions = list_response.get("ResourceDescriptions", [])
+        resources = [(resource_desc.get("Identifier", ""), self._get_listed_resource_obj(resource_desc))
+                     for resource_desc in resource_descriptions]
+        metrics.increment("ResourcesFromListProperties",
+                          sum(1 for _, resource_obj in resources if resource_obj is not None), Kind=self.kind)
+        return resources
+
+    def _get_listed_resource_obj(self, resource_desc):
+        # None when the listed properties aren't enough, so the resource is fetched with get_resource
+        if self.list_properties == "never" or not resource_desc.get("Properties"):
+            return None
+
+        resource_obj = json.loads(resource_desc["Properties"])
+        if self.list_properties == "always" or (self.required_keys is not None
+                                                and self.required_keys <= resource_obj.keys()):
+            return resource_obj
+        return None
+
+    def _get_required_keys(self):
+        required_keys = get_jq_queries_top_level_keys(get_entities_jq_queries(self.selector_query, self.mappings))
+        if required_keys is None:
+            logger.info(f"Getting every resource of kind: {self.kind}, its selector or mappings may read any property")
+            return None
+        if any(mapping.get("itemsToParse") for mapping in self.mappings):
+            required_keys.discard("item")  # Added to the resource for every parsed item
+        return required_keys
+
+    def fetch_resource(self, region, resource_id, action_type="upsert", resource_obj=None):
+        if action_type == "upsert":
+            if resource_obj is None:  # Single resource events, or listed properties missing keys the mappings read
+                log_sampled_debug(logger, f"Get resource for kind: {self.kind}, resource id: {resource_id}")
+                aws_cloudcontrol_client = get_client("cloudcontrol", region_name=region)
+                resource_obj = json.loads(aws_cloudcontrol_client.get_resource(TypeName=self.kind, Identifier=resource_id).get("ResourceDescription").get("Properties"))
+        elif action_type == "delete":
+            resource_obj = {"identifier": resource_id}  # Entity identifier to delete
+        return resource_obj
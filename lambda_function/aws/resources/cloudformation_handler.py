@@ -1,104 +1,71 @@
 import json
 import logging
 from collections import OrderedDict
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor
 
-import boto3
 import consts
-import yaml
+from aws.clients import get_client
 from aws.resources.base_handler import BaseHandler
-from port.entities import create_entities_json, handle_entities
+from observability import log_sampled_debug
 
 logger = logging.getLogger(__name__)
 
+# Bounds the concurrent stack resources and template requests of all stacks
+enrichment_executor = ThreadPoolExecutor(max_workers=consts.MAX_DEFAULT_AWS_WORKERS)
 
-class CloudFormationHandler(BaseHandler):
-    def handle(self):
-        for region in list(self.regions):
-            aws_cloudformation_client = boto3.client("cloudformation", region_name=region)
-            logger.info(f"List CloudFormation Stack, region: {region}")
-            self.next_token = "" if self.next_token is None else self.next_token
-            while self.next_token is not None:
-                list_stacks_params = self.selector_aws.get("list_parameters", {})
-                if self.next_token:
-                    list_stacks_params["NextToken"] = self.next_token
-                try:
-                    response = aws_cloudformation_client.list_stacks(**list_stacks_params)
-                except Exception as e:
-                    logger.error(
-                        f"Failed list CloudFormation Stack, region: {region},"
-                        f" Parameters: {list_stacks_params}; {e}")
-                    self.skip_delete = True
-                    self.next_token = None
-                    break
-
-                self._handle_list_response(response, region)
-
-                self.next_token = response.get("NextToken")
-                if self.lambda_context.get_remaining_time_in_millis()< consts.REMAINING_TIME_TO_REINVOKE_THRESHOLD:
-                    # Lambda timeout is too close, should return checkpoint for next run
-                    return self._handle_close_to_timeout(region)
-
-            self._cleanup_regions(region)
-
-        return {"aws_entities": self.aws_entities, "next_resource_config": None, "skip_delete": self.skip_delete}
-
-    def _handle_list_response(self, list_response, region):
-        stacks = list_response.get("StackSummaries", [])
-        with ThreadPoolExecutor(max_workers=consts.MAX_DEFAULT_AWS_WORKERS) as executor:
-            futures = [executor.submit(self.handle_single_resource_item, region, stack.get("StackId")) for stack in stacks if stack["StackStatus"] != "DELETE_COMPLETE"]
-            for completed_future in as_completed(futures):
-                result = completed_future.result()
-                self.aws_entities.update(result.get("aws_entities", set()))
-                self.skip_delete = result.get("skip_delete", False) if not self.skip_delete else self.skip_delete
-
-    def handle_single_resource_item(self, region, stack_id, action_type="upsert"):
-        entities = []
-        skip_delete = False
-        try:
-            stack_obj = {}
-            if action_type == "upsert":
-                logger.info(f"Get CloudFormation Stack, id: {stack_id}")
 
-                aws_cloudformation_client = boto3.client("cloudformation", region_name=region)
+class CloudFormationHandler(BaseHandler):
+    AWS_SERVICE = "cloudformation"
+    ENRICHMENTS = {"StackResources": "describe_stack_resources", "TemplateBody": "get_template"}
+
+    def _list_resources(self, region, next_token, resource_model=None):
+        # describe_stacks returns the full stacks in bulk, StackStatusFilter of list_stacks is applied locally
+        describe_stacks_params = {k: v for k, v in self.selector_aws.get("list_parameters", {}).items()
+                                  if k != "StackStatusFilter"}
+        if next_token:
+            describe_stacks_params["NextToken"] = next_token
+        response = get_client("cloudformation", region_name=region).describe_stacks(**describe_stacks_params)
+        return response, response.get("NextToken")
+
+    def _get_listed_resources(self, list_response, region):
+        stack_status_filter = self.selector_aws.get("list_parameters", {}).get("StackStatusFilter")
+        stacks = [stack for stack in list_response.get("Stacks", []) if stack["StackStatus"] != "DELETE_COMPLETE"
+                  and (not stack_status_filter or stack["StackStatus"] in stack_status_filter)]
+        return [(stack.get("StackId"), stack) for stack in stacks]
+
+    def fetch_resource(self, region, stack_id, action_type="upsert", stack_obj=None):
+        if action_type == "upsert":
+            log_sampled_debug(logger, f"Get CloudFormation Stack, id: {stack_id}")
+
+            aws_cloudformation_client = get_client("cloudformation", region_name=region)
+            if stack_obj is None:  # Single stack events, listed stacks are already described
                 stack_obj = aws_cloudformation_client.describe_stacks(StackName=stack_id).get("Stacks")[0]
-                stack_obj["StackResources"] = aws_cloudformation_client.describe_stack_resources(StackName=stack_id).get("StackResources")
-                template = aws_cloudformation_client.get_template(StackName=stack_id).get("TemplateBody")
+            stack_obj = dict(stack_obj)
+            enrichment_futures = {}
+            if "StackResources" in self.enrichments:
+                enrichment_futures["StackResources"] = enrichment_executor.submit(
+                    aws_cloudformation_client.describe_stack_resources, StackName=stack_id)
+            if "TemplateBody" in self.enrichments:
+                enrichment_futures["TemplateBody"] = enrichment_executor.submit(
+                    aws_cloudformation_client.get_template, StackName=stack_id)
+
+            if "StackResources" in enrichment_futures:
+                stack_obj["StackResources"] = enrichment_futures["StackResources"].result().get("StackResources")
+            if "TemplateBody" in enrichment_futures:
+                template = enrichment_futures["TemplateBody"].result().get("TemplateBody")
 
                 # Some templates return as nested OrderedDict, so we need to convert them
                 # to regular dicts using the json library and then to yaml strings for a clear yaml
                 if isinstance(template, OrderedDict):
+                    import yaml  # Only needed for these templates, so it's kept out of the cold start
                     template = yaml.dump(json.loads(json.dumps(template)))
 
                 stack_obj["TemplateBody"] = template
 
-                # Handles unserializable date properties in the JSON by turning them into a string
-                stack_obj = json.loads(json.dumps(stack_obj, default=str))
-
-            elif action_type == "delete":
-                stack_obj = {"identifier": stack_id}  # Entity identifier to delete
-
-            entities = create_entities_json(stack_obj, self.selector_query, self.mappings, action_type)
-
-        except Exception as e:
-            logger.error(f"Failed to extract or transform CloudFormation Stack with id: {stack_id}, error: {e}")
-            skip_delete = True
-
-        aws_entities = handle_entities(entities, self.port_client, action_type)
-
-        return {"aws_entities": aws_entities, "skip_delete": skip_delete}
-
-    def _handle_close_to_timeout(self, region):
-        if self.next_token:
-            self.selector_aws["next_token"] = self.next_token
-        else:
-            self.selector_aws.pop("next_token", None)
-            self._cleanup_regions(region)
-            if not self.regions:  # Nothing left to sync
-                return {"aws_entities": self.aws_entities, "next_resource_config": None, "skip_delete": self.skip_delete}
+            # Handles unserializable date properties in the JSON by turning them into a string
+            stack_obj = json.loads(json.dumps(stack_obj, default=str))
 
-        if "selector" not in self.resource_config:
-            self.resource_config["selector"] = {}
-        self.resource_config["selector"]["aws"] = self.selector_aws
+        elif action_type == "delete":
+            stack_obj = {"identifier": stack_id}  # Entity identifier to delete
 
-        return {"aws_entities": self.aws_entities, "next_resource_config": self.resource_config, "skip_delete": self.skip_delete}
+        return stack_obj
@@ -0,0 +1,217 @@
+import copy
+import json
+import logging
+import time
+import uuid
+from collections import defaultdict
+
+import consts
+from aws.clients import get_client
+from aws.s3 import delete_objects, list_objects
+
+logger = logging.getLogger(__name__)
+
+
+class FanOutRun:
+    # A sync split into shards, a resource kind in a single region each, which are synced in parallel by up to
+    # max_parallel_shards lanes. A lane is a chain of Lambda invocations, syncing one unclaimed shard after the other.
+    # The run state is kept in S3, under {prefix}/{run id}/:
+    #   shards/{index}/claim-{attempt}-{lane id}  written by the lanes claiming the shard
+    #   shards/{index}/heartbeat                 written by every invocation syncing the shard
+    #   shards/{index}/done                      seen entities chunks of the synced shard
+    #   finalization/claim-{attempt}-{lane id}   written by the lanes claiming the stale entities deletion
+    #   finalization/heartbeat                   written while the stale entities are deleted
+    # and {prefix}/current.json holds the run in progress. Its shards keep their resource config, and the run the
+    # blueprints mapped when it started, so config changes made while it runs only apply to the next run.
+    # S3 writes can't be made conditional with the boto3 version of the layer, so a lane claims a shard by writing its
+    # claim and listing the claims of the same attempt, the smallest lane id wins. Claims racing each other may rarely
+    # sync a shard twice, which only costs time as syncing is idempotent.
+    def __init__(self, bucket_name, prefix, state, invoke_function):
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+        self.state = state
+        self.run_id = state["run_id"]
+        self.run_prefix = f"{prefix}/{self.run_id}"
+        self.invoke_function = invoke_function
+
+    @classmethod
+    def start(cls, bucket_name, prefix, run_id, resources_config, mapped_blueprints, default_region,
+              max_parallel_shards, invoke_function):
+        shards = [{"region": region, "resource_config": cls.get_shard_resource_config(resource_config, region)}
+                  for resource_config in resources_config
+                  for region in resource_config.get("selector", {}).get("aws", {}).get("regions", [default_region])]
+        state = {"run_id": run_id, "shards": shards, "mapped_blueprints": mapped_blueprints,
+                 "max_parallel_shards": max_parallel_shards, "started_at": time.time()}
+        get_client("s3").put_object(Body=json.dumps(state), Bucket=bucket_name, Key=f"{prefix}/current.json")
+
+        run = cls(bucket_name, prefix, state, invoke_function)
+        logger.info(f"Started fanned out sync: {run_id}, {len(shards)} shards")
+        run.launch_lanes(min(max_parallel_shards, len(shards)))
+        return run
+
+    @classmethod
+    def load_current(cls, bucket_name, prefix, invoke_function):
+        aws_s3_client = get_client("s3")
+        try:
+            state = json.loads(aws_s3_client.get_object(Bucket=bucket_name, Key=f"{prefix}/current.json")["Body"].read())
+        except aws_s3_client.exceptions.NoSuchKey:
+            return None
+        return cls(bucket_name, prefix, state, invoke_function)
+
+    @staticmethod
+    def get_shard_resource_config(resource_config, region):
+        shard_resource_config = copy.deepcopy(resource_config)
+        selector_aws = shard_resource_config.setdefault("selector", {}).setdefault("aws", {})
+        selector_aws["regions"] = [region]
+        if region in selector_aws.get("regions_config", {}):
+            selector_aws["regions_config"] = {region: selector_aws["regions_config"][region]}
+        return shard_resource_config
+
+    def is_expired(self):
+        return time.time() - self.state["started_at"] > consts.FAN_OUT_RUN_TIMEOUT_SECONDS
+
+    def launch_lanes(self, count):
+        for _ in range(count):
+            self.invoke_function({"fan_out_lane": {"run_id": self.run_id, "lane_id": uuid.uuid4().hex}})
+
+    def check_lanes(self):
+        # Relaunches lanes for shards left unclaimed or abandoned by lanes that timed out, up to the parallelism cap
+        shards_status = self._get_shards_status()
+        if all(status["done"] for status in shards_status.values()):
+            finalization_status = self._get_finalization_status()
+            if not finalization_status["attempts"]:
+                logger.info(f"Fanned out sync: {self.run_id}, launching a lane to delete the stale entities")
+                self.launch_lanes(1)
+            elif self._is_timed_out(finalization_status):
+                logger.warning(f"Fanned out sync: {self.run_id}, stale entities deletion timed out,"
+                               f" launching a lane to take it over")
+                self.launch_lanes(1)
+            return
+
+        syncing_count = sum(1 for status in shards_status.values()
+                            if status["attempts"] and not status["done"] and not self._is_timed_out(status))
+        waiting_count = len(self.state["shards"]) - syncing_count - sum(
+            1 for status in shards_status.values() if status["done"])
+        lanes_count = min(self.state["max_parallel_shards"] - syncing_count, waiting_count)
+        if lanes_count > 0:
+            logger.info(f"Fanned out sync: {self.run_id}, launching {lanes_count} lanes for {waiting_count} shards")
+            self.launch_lanes(lanes_count)
+
+    def claim_next_shard(self, lane_id):
+        shards_status = self._get_shards_status()
+        for index, shard in enumerate(self.state["shards"]):
+            status = shards_status[index]
+            if status["done"]:
+                continue
+            if status["attempts"]:
+                if not self._is_timed_out(status):
+                    continue  # Synced by another lane
+                if status["attempts"] >= consts.FAN_OUT_SHARD_MAX_ATTEMPTS:
+                    logger.error(f"Shard: {index} of fanned out sync: {self.run_id} timed out {status['attempts']}"
+                                 f" times, stale entities won't be deleted")
+                    self.complete_shard(index, [], skip_delete=True)
+                    continue
+                logger.warning(f"Shard: {index} of fanned out sync: {self.run_id} timed out, syncing it again")
+
+            if self._claim(f"{self.run_prefix}/shards/{index}/claim-{status['attempts'] + 1:03d}-", lane_id):
+                self.heartbeat(index)
+                return {"index": index, **shard}
+        return None
+
+    def heartbeat(self, index):
+        get_client("s3").put_object(Body=b"", Bucket=self.bucket_name, Key=f"{self.run_prefix}/shards/{index}/heartbeat")
+
+    def complete_shard(self, index, seen_entities_chunks, skip_delete):
+        # A shard synced again after a timeout may be completed twice, only the first results are kept
+        if self._list_objects(f"{self.run_prefix}/shards/{index}/done"):
+            return False
+        get_client("s3").put_object(Body=json.dumps({"seen_entities_chunks": seen_entities_chunks,
+                                                     "skip_delete": skip_delete}),
+                                    Bucket=self.bucket_name, Key=f"{self.run_prefix}/shards/{index}/done")
+        return True
+
+    def get_results(self):
+        # Results of all the shards, or None while some of them are still syncing
+        shards_status = self._get_shards_status()
+        if not all(status["done"] for status in shards_status.values()):
+            return None
+
+        aws_s3_client = get_client("s3")
+        return [json.loads(aws_s3_client.get_object(Bucket=self.bucket_name,
+                                                    Key=f"{self.run_prefix}/shards/{index}/done")["Body"].read())
+                for index in range(len(self.state["shards"]))]
+
+    def claim_finalization(self, lane_id):
+        # Lanes finishing together may both find all the shards done, only one of them deletes the stale entities.
+        # A deletion abandoned by a lane that timed out is taken over, like shards are
+        status = self._get_finalization_status()
+        if status["attempts"]:
+            if not self._is_timed_out(status):
+                return False  # Deleted by another lane
+            if status["attempts"] >= consts.FAN_OUT_SHARD_MAX_ATTEMPTS:
+                logger.error(f"Stale entities deletion of fanned out sync: {self.run_id} timed out"
+                             f" {status['attempts']} times, stale entities won't be deleted")
+                self.cleanup()
+                return False
+            logger.warning(f"Stale entities deletion of fanned out sync: {self.run_id} timed out, taking it over")
+
+        if not self._claim(f"{self.run_prefix}/finalization/claim-{status['attempts'] + 1:03d}-", lane_id):
+            return False
+        self.heartbeat_finalization()
+        return True
+
+    def heartbeat_finalization(self):
+        get_client("s3").put_object(Body=b"", Bucket=self.bucket_name, Key=f"{self.run_prefix}/finalization/heartbeat")
+
+    def cleanup(self):
+        aws_s3_client = get_client("s3")
+        keys = [s3_object["Key"] for s3_object in self._list_objects(f"{self.run_prefix}/")]
+        for done_key in [key for key in keys if key.endswith("/done")]:
+            try:
+                keys += json.loads(aws_s3_client.get_object(Bucket=self.bucket_name,
+                                                            Key=done_key)["Body"].read())["seen_entities_chunks"]
+            except Exception as e:
+                logger.warning(f"Failed to read shard results, bucket: {self.bucket_name}, key: {done_key}; {e}")
+
+        current = FanOutRun.load_current(self.bucket_name, self.prefix, self.invoke_function)
+        if current and current.run_id == self.run_id:
+            keys.append(f"{self.prefix}/current.json")
+
+        logger.info(f"Cleaning fanned out sync: {self.run_id}, {len(keys)} objects")
+        delete_objects(self.bucket_name, keys)
+
+    def _claim(self, claim_prefix, lane_id):
+        get_client("s3").put_object(Body=b"", Bucket=self.bucket_name, Key=f"{claim_prefix}{lane_id}")
+        return min(s3_object["Key"][len(claim_prefix):] for s3_object in self._list_objects(claim_prefix)) == lane_id
+
+    def _get_shards_status(self):
+        shards_status = defaultdict(lambda: {"attempts": 0, "last_seen": 0, "done": False})
+        for s3_object in self._list_objects(f"{self.run_prefix}/shards/"):
+            index, name = s3_object["Key"][len(f"{self.run_prefix}/shards/"):].split("/", 1)
+            status = shards_status[int(index)]
+            if name == "done":
+                status["done"] = True
+            else:
+                self._update_status(status, name, s3_object)
+        return {index: shards_status[index] for index in range(len(self.state["shards"]))}
+
+    def _get_finalization_status(self):
+        status = {"attempts": 0, "last_seen": 0}
+        for s3_object in self._list_objects(f"{self.run_prefix}/finalization/"):
+            self._update_status(status, s3_object["Key"][len(f"{self.run_prefix}/finalization/"):], s3_object)
+        return status
+
+    @staticmethod
+    def _update_status(status, name, s3_object):
+        if name.startswith("claim-"):
+            status["attempts"] = max(status["attempts"], int(name.split("-")[1]))
+        status["last_seen"] = max(status["last_seen"], s3_object["LastModified"].timestamp())
+
+    @staticmethod
+    def _is_timed_out(status):
+        # Every invocation syncing a shard or deleting the stale entities writes its heartbeat, so a shard or the
+        # deletion is timed out once its lane stopped
+        return time.time() - status["last_seen"] > consts.FAN_OUT_SHARD_TIMEOUT_SECONDS
+
+    def _list_objects(self, prefix):
+        return list_objects(self.bucket_name, prefix)
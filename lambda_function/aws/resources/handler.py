@@ -1,21 +1,36 @@
+import gzip
 import json
 import logging
+import os
+import threading
+from collections import defaultdict
 from concurrent.futures import ThreadPoolExecutor
 
-import boto3
+import requests
 
 import consts
-import jq
-from aws.resources.handler_creator import create_resource_handler
+from aws.clients import get_client
+from aws.resources.fan_out import FanOutRun
+from aws.resources.handler_creator import create_resource_handler, get_resource_handler_class
+from aws.resources.pipeline import ResourcesPipeline
+from aws.resources.time_budget import TimeBudget
+from aws.s3 import delete_objects
+from observability import metrics
+from port.batch_writer import EntitiesBatchWriter
 from port.client import PortClient
+from port.entities import compile_jq_query, get_mappings_blueprints
+from port.entities_index import EntitiesIndex
+from port.seen_entities import SeenEntities
 
 logger = logging.getLogger(__name__)
 
 
 class ResourcesHandler:
-    def __init__(self, config, lambda_context):
+    def __init__(self, config, lambda_context, invoke_function=None):
         self.config = config
         self.lambda_context = lambda_context
+        # Invokes this Lambda asynchronously with the given payload, replaceable to run invocations locally
+        self.invoke_function = invoke_function or self._invoke_lambda_async
         split_arn = lambda_context.invoked_function_arn.split(":")
         self.region = split_arn[3]
         self.account_id = split_arn[4]
@@ -27,13 +42,31 @@ class ResourcesHandler:
         self.port_client = PortClient(port_client_id, port_client_secret,
                                       user_agent=f"{consts.PORT_AWS_EXPORTER_NAME}/0.1 ({self.user_id})",
                                       api_url=self.config.get("port_api_url", consts.PORT_API_URL))
-        self.event = self.config.get("event")
+        self.event = self.config.get("event") or {}
         self.bucket_name = self.config["bucket_name"]
+        # Set while syncing a shard of a fanned out sync, and kept in its checkpoints
+        self.fan_out_shard = self.config.get("fan_out_shard")
+        # Set while deleting the stale entities of a fanned out sync, which keeps its deletion claim alive
+        self.finalizing_fan_out_run = None
+        self.entities_index = EntitiesIndex(self.bucket_name, self.config["entities_index_file_key"],
+                                            self.config["entities_index_changes_prefix"]) \
+            if self.config.get("entities_index_file_key") else None
+        # Events are always pushed, and only recorded in the index, so syncs don't skip what they changed in Port
+        self.entities_writer = EntitiesBatchWriter(self.port_client, entities_index=self.entities_index,
+                                                   skip_unchanged=not self.event.get("Records"))
+        self.pipeline = ResourcesPipeline(self.entities_writer)
         self.next_config_file_key = self.config.get("next_config_file_key")
-        self.aws_entities = set(self.config.get("aws_entities", []))
+        # Entities seen by previous runs are kept in S3 chunks, inline aws_entities is only read for older checkpoints
+        self.aws_entities = SeenEntities(self.config.pop("aws_entities", []))
+        self.seen_entities_chunks = self.config.get("seen_entities_chunks", [])
         self.resources_config = self.config["resources"]
+        self._initial_resources_state = json.dumps(self.resources_config)
+        if "mapped_blueprints" not in self.config:  # Kept in the checkpoint, as it only holds the kinds left to sync
+            self.config["mapped_blueprints"] = self._get_mapped_blueprints()
         self.skip_delete = self.config.get("skip_delete", False)
         self.require_reinvoke = False
+        self.time_budget = TimeBudget(lambda_context)
+        self._lock = threading.Lock()
 
     def _upsert_integration(self):
         integration_id = f"{self.region}:{self.account_id}"
@@ -42,73 +75,255 @@ class ResourcesHandler:
         self.port_client.upsert_integration(integration)
 
     def handle(self):
+        try:
+            return self._handle()
+        finally:
+            self.pipeline.close()
+            self.entities_writer.close()
+            if self.entities_index:
+                self.entities_index.save()
+            self.port_client.log_stats()
+
+    def _handle(self):
         self._upsert_integration()
 
-        if self.event and self.event.get("Records"):  # Single events from SQS
+        if self.event.get("Records"):  # Single events from SQS
             logger.info("Handle events from sqs")
-            for record in self.event.get("Records"):
-                try:
-                    resource = json.loads(record["body"])
-                    self._handle_event_resource(resource)
-                except Exception as e:
-                    logger.error(f"Failed to handle event: {self.event}, error: {e}")
+            with metrics.timer("StageDuration", Stage="events"):
+                return self._handle_events(self.event.get("Records"))
+
+        if not self.fan_out_shard and self.event.get("fan_out_lane"):  # Next shard of a fanned out sync
+            if not self._claim_fan_out_shard(self.event["fan_out_lane"]):
+                self._finalize_fan_out_run(self.event["fan_out_lane"])
+                return
+        elif not self.fan_out_shard and self.config.get("fan_out", {}).get("enabled"):
+            self._coordinate_fan_out()
+            return
+
+        if self.fan_out_shard and not self._heartbeat_fan_out_shard():
             return
 
         logger.info("Starting upsert of AWS resources to Port")
 
-        self._upsert_resources()
+        with metrics.timer("StageDuration", Stage="upsert"):
+            self._upsert_resources()
+            self.entities_writer.flush()
 
         if self.require_reinvoke:
-            return self._reinvoke_lambda()
+            self._reinvoke_lambda()
+            return
 
         logger.info("Done upsert of AWS resources to Port")
 
-        if not self.skip_delete:
-            logger.info("Starting delete process of stale resources from Port")
-            self._delete_stale_resources()
-            logger.info("Done deleting stale resources from Port")
+        if self.fan_out_shard:  # Stale entities are deleted once all the shards are synced
+            self._complete_fan_out_shard()
+            return
+
+        # A Lambda invoked only for the deletion deletes anyway, whatever time it has
+        if not self.skip_delete and self.resources_config and \
+                self.lambda_context.get_remaining_time_in_millis() < consts.STALE_ENTITIES_DELETE_MIN_REMAINING_MS:
+            logger.info("Not enough time left to delete stale resources, a new Lambda will be invoked to delete them.")
+            self.config["resources"] = []
+            self.config["skip_delete"] = self.skip_delete
+            self._reinvoke_lambda()
+            return
+
+        self._load_and_delete_stale_resources()
+        self._delete_seen_entities()
+        if self.entities_index:
+            self.entities_index.compact()
 
         logger.info("Done handling your resources")
 
-    def _handle_event_resource(self, resource):
+    def _handle_events(self, records):
+        # Only the last event of every resource is handled, as it holds its latest action
+        events = {}
+        for record in records:
+            try:
+                event = self._parse_event(json.loads(record["body"]))
+                event_key = (event["kind"], event["region"], event["identifier"])
+                events.pop(event_key, None)
+            except Exception as e:
+                # Retrying won't help malformed events, so they aren't returned to the queue
+                logger.error(f"Failed to parse event: {record.get('body')}, error: {e}")
+                continue
+            events[event_key] = {**event, "message_id": record.get("messageId")}
+
+        events_by_kind_region = defaultdict(list)
+        for (kind, region, _), event in events.items():
+            events_by_kind_region[(kind, region)].append(event)
+
+        resource_configs_by_kind = defaultdict(list)
+        for resource_config in self.resources_config:
+            resource_configs_by_kind[resource_config["kind"]].append(resource_config)
+
+        handlers_by_kind = {}
+        submissions_by_message_id = defaultdict(list)
+        for (kind, region), kind_events in events_by_kind_region.items():
+            if not resource_configs_by_kind.get(kind):
+                logger.error(f"Resource config not found for kind: {kind}, skipping {len(kind_events)} events")
+                continue
+            if kind not in handlers_by_kind:
+                handlers_by_kind[kind] = [create_resource_handler(resource_config, self.port_client, self.lambda_context,
+                                                                  region, self.pipeline)
+                                          for resource_config in resource_configs_by_kind[kind]]
+
+            logger.info(f"Handle {len(kind_events)} events of kind: {kind}, region: {region}")
+            for event in kind_events:
+                for resource_handler in handlers_by_kind[kind]:
+                    future = self.pipeline.submit(resource_handler, region, event["identifier"], event["action_type"])
+                    submissions_by_message_id[event["message_id"]].append((resource_handler, region, event, future))
+
+        results_by_message_id = defaultdict(list)
+        delete_futures_by_message_id = defaultdict(list)
+        for message_id, submissions in submissions_by_message_id.items():
+            for resource_handler, region, event, future in submissions:
+                result = future.result()
+                error = (getattr(result.get("error"), "response", None) or {}).get("Error", {})
+                if event["action_type"] == "upsert" and self._is_not_found_error(error):
+                    # Deleted since the event was sent, so its entities are deleted too
+                    logger.info(f"Resource id: {event['identifier']} of kind: {resource_handler.kind} no longer exists,"
+                                f" deleting its entities")
+                    delete_futures_by_message_id[message_id].append(self.pipeline.submit(
+                        resource_handler, region, event["identifier"], "delete"))
+                elif error.get("Code") in consts.AWS_ACCESS_DENIED_ERROR_CODES:
+                    logger.error(f"Access denied to resource id: {event['identifier']} of kind: {resource_handler.kind},"
+                                 f" skipping its event as retrying it would fail again")
+                else:
+                    results_by_message_id[message_id].append(result)
+        for message_id, futures in delete_futures_by_message_id.items():
+            results_by_message_id[message_id].extend(future.result() for future in futures)
+        self.entities_writer.flush()
+
+        # Failed events are returned to the queue, the rest of the batch is deleted from it
+        batch_item_failures = [{"itemIdentifier": message_id} for message_id, results in results_by_message_id.items()
+                               if any(result["skip_delete"] or result["aws_entities"] & self.entities_writer.failed_entities
+                                      for result in results)]
+        metrics.increment("EventsHandled", len(records) - len(batch_item_failures))
+        metrics.increment("EventsFailed", len(batch_item_failures))
+        if batch_item_failures:
+            logger.warning(f"Failed to handle {len(batch_item_failures)} out of {len(records)} events")
+        return {"batchItemFailures": batch_item_failures}
+
+    @staticmethod
+    def _is_not_found_error(error):
+        # CloudFormation reports missing stacks as validation errors
+        return error.get("Code", "").endswith(consts.AWS_NOT_FOUND_ERROR_CODE_SUFFIXES) or (
+                error.get("Code") == "ValidationError" and "does not exist" in error.get("Message", ""))
+
+    @staticmethod
+    def _parse_event(resource):
         assert "identifier" in resource, "Event must include 'identifier'"
         assert "region" in resource, "Event must include 'region'"
-        region = jq.first(resource["region"], resource)
-        identifier = jq.first(resource["identifier"], resource)
+        region = compile_jq_query(resource["region"]).input(resource).first()
+        identifier = compile_jq_query(resource["identifier"]).input(resource).first()
+        assert isinstance(region, str) and isinstance(identifier, str), "Event region and identifier must be strings"
 
-        action_type = str(jq.first(resource.get("action", '"upsert"'), resource)).lower()
+        action_type = str(compile_jq_query(resource.get("action", '"upsert"')).input(resource).first()).lower()
         assert action_type in ["upsert", "delete"], f"Action should be one of 'upsert', 'delete'"
 
-        resource_configs = [resource_config for resource_config in self.resources_config if
-                            resource_config["kind"] == resource["resource_type"]]
-        assert resource_configs, f"Resource config not found for kind: {resource['resource_type']}"
-
-        for resource_config in resource_configs:
-            resource_handler = create_resource_handler(resource_config, self.port_client, self.lambda_context, region)
-            resource_handler.handle_single_resource_item(region, identifier, action_type)
+        return {"kind": resource["resource_type"], "region": region, "identifier": identifier,
+                "action_type": action_type}
 
     def _upsert_resources(self):
-        for resource_index, resource in enumerate(list(self.resources_config)):
-            resource_handler = create_resource_handler(resource, self.port_client, self.lambda_context, self.region)
-            result = resource_handler.handle()
-            self.aws_entities.update(result.get("aws_entities", set()))
-            next_resource_config = result.get("next_resource_config")
-            self.skip_delete = result.get("skip_delete", False) if not self.skip_delete else self.skip_delete
-            self.resources_config[resource_index] = next_resource_config
+        # Kinds of different AWS services are synced concurrently, kinds of the same service one after the other
+        resources_indexes_by_service = defaultdict(list)
+        for resource_index, resource in enumerate(self.resources_config):
+            if resource:
+                resources_indexes_by_service[get_resource_handler_class(resource["kind"]).AWS_SERVICE].append(
+                    resource_index)
+
+        if resources_indexes_by_service:
+            max_workers = min(len(resources_indexes_by_service), consts.MAX_CONCURRENT_RESOURCE_KINDS)
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = [executor.submit(self._upsert_service_resources, resources_indexes)
+                           for resources_indexes in resources_indexes_by_service.values()]
+                for future in futures:
+                    future.result()
+
+        # Kinds are left unsynced only when the Lambda is close to timeout
+        if any(self.resources_config):
+            self._handle_close_to_timeout()
 
-            if self.lambda_context.get_remaining_time_in_millis() < consts.REMAINING_TIME_TO_REINVOKE_THRESHOLD:
-                self._handle_close_to_timeout()
+    def _upsert_service_resources(self, resources_indexes):
+        for resource_index in resources_indexes:
+            if not self.time_budget.has_time_for_page():
                 break
 
+            resource_handler = create_resource_handler(self.resources_config[resource_index], self.port_client,
+                                                       self.lambda_context, self.region, self.pipeline)
+            result = resource_handler.handle()
+            with self._lock:
+                self.aws_entities.update(result.get("aws_entities", set()))
+                self.skip_delete = result.get("skip_delete", False) if not self.skip_delete else self.skip_delete
+                self.resources_config[resource_index] = result.get("next_resource_config")
+
     def _handle_close_to_timeout(self):
         self.config["resources"] = [res_config for res_config in self.resources_config if res_config]
-        if self.config["resources"]:
+        if self.config["resources"] and json.dumps(self.config["resources"]) == self._initial_resources_state:
+            # Re-invoking would loop forever, when the Lambda timeout leaves no time for even a single page
+            logger.error("No resources were synced before the time budget ran out, stopping the sync process."
+                         " Increase the Lambda timeout to sync your resources")
+            self.skip_delete = True
+        elif self.config["resources"]:
             logger.info("Lambda will be timed out soon, a new Lambda will be invoked to continue the sync process.")
-            self.config["aws_entities"] = list(self.aws_entities)
             self.config["skip_delete"] = self.skip_delete
             self.require_reinvoke = True
 
+    def _get_mapped_blueprints(self):
+        blueprints = set()
+        for resource_config in self.resources_config:
+            blueprints.update(get_mappings_blueprints(
+                resource_config.get("port", {}).get("entity", {}).get("mappings", [])))
+
+        return sorted(blueprints)
+
+    def _load_and_delete_stale_resources(self):
+        if not self.skip_delete:
+            self._load_seen_entities()
+
+        if not self.skip_delete:
+            logger.info("Starting delete process of stale resources from Port")
+            with metrics.timer("StageDuration", Stage="delete_stale"):
+                self._delete_stale_resources()
+            logger.info("Done deleting stale resources from Port")
+
     def _delete_stale_resources(self):
+        # Blueprints of previous runs are searched as well, so entities of kinds removed from the config are deleted
+        previously_mapped_blueprints = self._load_mapped_blueprints()
+        blueprints_with_stale_entities = set()
+        deleted_blueprints = set()
+        deleted_entities_count = 0
+        reached_limit = False
+        for port_entities in self._search_exporter_entities(previously_mapped_blueprints, deleted_blueprints):
+            stale_entities = [entity for entity in port_entities
+                              if not self.aws_entities.contains(entity.get("blueprint"), entity.get("identifier"))]
+            blueprints_with_stale_entities.update(entity.get("blueprint") for entity in stale_entities)
+            if deleted_entities_count + len(stale_entities) > consts.STALE_ENTITIES_DELETE_LIMIT:
+                stale_entities = stale_entities[:consts.STALE_ENTITIES_DELETE_LIMIT - deleted_entities_count]
+                logger.warning(f"Reached the limit of {consts.STALE_ENTITIES_DELETE_LIMIT} stale entities to delete"
+                               f" in a single run, the rest will be deleted in the next runs")
+
+            metrics.increment("StaleEntitiesFound", len(stale_entities))
+            if self.finalizing_fan_out_run:
+                self.finalizing_fan_out_run.heartbeat_finalization()
+            # Deleted a page at a time, so the entities pending deletion stay bounded
+            self.entities_writer.write(stale_entities, "delete")
+            self.entities_writer.flush()
+            deleted_entities_count += len(stale_entities)
+            if deleted_entities_count >= consts.STALE_ENTITIES_DELETE_LIMIT:
+                reached_limit = True
+                break
+
+        if reached_limit and previously_mapped_blueprints is None:
+            return  # Blueprints the global search didn't reach yet are only found by searching globally again
+        # Blueprints no longer mapped are kept until none of their entities are left
+        mapped_blueprints = set(self.config["mapped_blueprints"]) | blueprints_with_stale_entities
+        if reached_limit:
+            mapped_blueprints.update(previously_mapped_blueprints)
+        self._save_mapped_blueprints(sorted(mapped_blueprints - deleted_blueprints))
+
+    def _search_exporter_entities(self, blueprint_ids, deleted_blueprints):
         query = {
             "combinator": "and",
             "rules": [
@@ -124,29 +339,192 @@ class ResourcesHandler:
                 },
             ],
         }
-        port_entities = self.port_client.search_entities(query)
 
-        with ThreadPoolExecutor(max_workers=consts.MAX_PORT_WORKERS) as executor:
-            executor.map(self.port_client.delete_entity,
-                         [entity for entity in port_entities if
-                          f"{entity.get('blueprint')};{entity.get('identifier')}" not in self.aws_entities])
+        if blueprint_ids is None:
+            # Without the blueprints of previous runs, all the entities of the exporter are searched at once
+            yield self.port_client.search_entities(query)
+            return
+
+        for blueprint_id in sorted(set(self.config["mapped_blueprints"]) | set(blueprint_ids)):
+            next_page = None
+            while True:
+                try:
+                    port_entities, next_page = self.port_client.search_blueprint_entities(blueprint_id, query,
+                                                                                          next_page)
+                except requests.HTTPError as e:
+                    if getattr(e.response, "status_code", None) != 404:
+                        raise
+                    # Deleted from Port along with its entities, so there is nothing left to delete
+                    logger.warning(f"Blueprint: {blueprint_id} wasn't found in Port, skipping its stale entities")
+                    deleted_blueprints.add(blueprint_id)
+                    break
+                yield [{**entity, "blueprint": entity.get("blueprint", blueprint_id)} for entity in port_entities]
+                if not next_page:
+                    break
+
+    def _load_mapped_blueprints(self):
+        if not self.config.get("mapped_blueprints_file_key"):
+            return None
+
+        aws_s3_client = get_client("s3")
+        try:
+            response = aws_s3_client.get_object(Bucket=self.bucket_name, Key=self.config["mapped_blueprints_file_key"])
+            return json.loads(response["Body"].read())
+        except aws_s3_client.exceptions.NoSuchKey:
+            logger.info("Blueprints of previous runs not found, searching all the entities of the exporter")
+        except Exception as e:
+            logger.warning(f"Failed to load the blueprints of previous runs, bucket: {self.bucket_name},"
+                           f" key: {self.config['mapped_blueprints_file_key']},"
+                           f" searching all the entities of the exporter; {e}")
+        return None
+
+    def _save_mapped_blueprints(self, blueprint_ids):
+        if not self.config.get("mapped_blueprints_file_key"):
+            return
+
+        try:
+            get_client("s3").put_object(Body=json.dumps(blueprint_ids), Bucket=self.bucket_name,
+                                        Key=self.config["mapped_blueprints_file_key"])
+        except Exception as e:
+            logger.warning(f"Failed to save the mapped blueprints, bucket: {self.bucket_name},"
+                           f" key: {self.config['mapped_blueprints_file_key']}; {e}")
 
     def _reinvoke_lambda(self):
+        self._save_seen_entities()
         self._save_config_state()
-        payload = {"next_config_file_key": self.next_config_file_key}
+        if self.entities_index:
+            self.entities_index.save()
+        metrics.increment("Reinvocations")
+        self.invoke_function({"next_config_file_key": self.next_config_file_key})
+
+    def _invoke_lambda_async(self, payload):
+        get_client("lambda").invoke(FunctionName=self.lambda_context.function_name, InvocationType="Event",
+                                    Payload=json.dumps(payload))
 
-        aws_lambda_client = boto3.client("lambda")
-        return aws_lambda_client.invoke(FunctionName=self.lambda_context.function_name, InvocationType="Event",
-                                        Payload=json.dumps(payload))
+    def _heartbeat_fan_out_shard(self):
+        fan_out_run = FanOutRun.load_current(self.bucket_name, self.config["fan_out_prefix"], self.invoke_function)
+        if not fan_out_run or fan_out_run.run_id != self.fan_out_shard["run_id"]:
+            logger.warning(f"Fanned out sync: {self.fan_out_shard['run_id']} is no longer in progress,"
+                           f" stopping the sync of shard: {self.fan_out_shard['index']}")
+            self._delete_seen_entities()
+            return False
 
-        # self.__init__(self.config, self.lambda_context)  # return self.handle()
+        fan_out_run.heartbeat(self.fan_out_shard["index"])
+        return True
+
+    def _coordinate_fan_out(self):
+        fan_out_run = FanOutRun.load_current(self.bucket_name, self.config["fan_out_prefix"], self.invoke_function)
+        if fan_out_run and not fan_out_run.is_expired():
+            logger.info(f"Fanned out sync: {fan_out_run.run_id} is still in progress, checking its lanes")
+            fan_out_run.check_lanes()
+            return
+
+        if fan_out_run:
+            logger.warning(f"Fanned out sync: {fan_out_run.run_id} didn't finish in time, starting a new one")
+            fan_out_run.cleanup()
+        FanOutRun.start(self.bucket_name, self.config["fan_out_prefix"], self.lambda_context.aws_request_id,
+                        self.resources_config, self.config["mapped_blueprints"], self.region,
+                        self.config["fan_out"].get("max_parallel_shards", consts.FAN_OUT_MAX_PARALLEL_SHARDS),
+                        self.invoke_function)
+
+    def _claim_fan_out_shard(self, fan_out_lane):
+        fan_out_run = FanOutRun.load_current(self.bucket_name, self.config["fan_out_prefix"], self.invoke_function)
+        if not fan_out_run or fan_out_run.run_id != fan_out_lane["run_id"]:
+            logger.info(f"Fanned out sync: {fan_out_lane['run_id']} is no longer in progress")
+            return False
+
+        shard = fan_out_run.claim_next_shard(fan_out_lane["lane_id"])
+        if not shard:
+            return False
+
+        # Synced with the resource config of the run, the config may have been changed since it started
+        resource_config = shard.pop("resource_config")
+        logger.info(f"Sync shard: {shard['index']} of fanned out sync: {fan_out_run.run_id},"
+                    f" kind: {resource_config['kind']}, region: {shard['region']}")
+        self.fan_out_shard = self.config["fan_out_shard"] = {**fan_out_lane, **shard}
+        self.resources_config = self.config["resources"] = [resource_config]
+        self._initial_resources_state = json.dumps(self.resources_config)
+        return True
+
+    def _complete_fan_out_shard(self):
+        self._save_seen_entities()
+        fan_out_run = FanOutRun.load_current(self.bucket_name, self.config["fan_out_prefix"], self.invoke_function)
+        is_run_in_progress = fan_out_run and fan_out_run.run_id == self.fan_out_shard["run_id"]
+        if not is_run_in_progress or not fan_out_run.complete_shard(self.fan_out_shard["index"],
+                                                                    self.seen_entities_chunks, self.skip_delete):
+            # A straggler, its shard was synced again by another lane after it timed out
+            logger.warning(f"Shard: {self.fan_out_shard['index']} of fanned out sync: {self.fan_out_shard['run_id']}"
+                           f" was already completed, dropping its results")
+            self._delete_seen_entities()
+
+        if is_run_in_progress:  # The lane goes on with its next shard in a new invocation, with a full time budget
+            self.invoke_function({"fan_out_lane": {"run_id": self.fan_out_shard["run_id"],
+                                                   "lane_id": self.fan_out_shard["lane_id"]}})
+
+    def _finalize_fan_out_run(self, fan_out_lane):
+        run_id = fan_out_lane["run_id"]
+        fan_out_run = FanOutRun.load_current(self.bucket_name, self.config["fan_out_prefix"], self.invoke_function)
+        if not fan_out_run or fan_out_run.run_id != run_id:
+            return
+        shards_results = fan_out_run.get_results()
+        if shards_results is None or not fan_out_run.claim_finalization(fan_out_lane["lane_id"]):
+            return  # Other lanes are still syncing, the last one to finish deletes the stale entities
+
+        logger.info(f"All shards of fanned out sync: {run_id} are synced")
+        self.seen_entities_chunks = [chunk_key for shard_results in shards_results
+                                     for chunk_key in shard_results["seen_entities_chunks"]]
+        self.skip_delete = any(shard_results["skip_delete"] for shard_results in shards_results)
+        self.config["mapped_blueprints"] = fan_out_run.state["mapped_blueprints"]
+        self.finalizing_fan_out_run = fan_out_run
+        self._load_and_delete_stale_resources()
+        if self.entities_index:
+            self.entities_index.compact()  # Changes saved by the shards included
+        fan_out_run.cleanup()  # Seen entities chunks of the shards included
 
     def _save_config_state(self):
-        aws_s3_client = boto3.client("s3")
+        aws_s3_client = get_client("s3")
+        config_state = json.dumps(self.config)
+        metrics.put("CheckpointSize", len(config_state), "Bytes")
         try:
-            aws_s3_client.put_object(Body=json.dumps(self.config), Bucket=self.bucket_name,
-                                     Key=self.next_config_file_key)
+            aws_s3_client.put_object(Body=config_state, Bucket=self.bucket_name, Key=self.next_config_file_key)
         except Exception as e:
             logger.warning(
                 f"Failed to save lambda state, bucket: {self.bucket_name}, key: {self.next_config_file_key}; {e}")
             self.skip_delete = True
+
+    def _save_seen_entities(self):
+        # Each run appends only the entities it saw, the final run merges them all for the stale entities deletion
+        if self.skip_delete or not self.aws_entities:
+            return
+
+        aws_s3_client = get_client("s3")
+        seen_entities_prefix = os.path.join(os.path.dirname(self.next_config_file_key), "seen_entities")
+        try:
+            for chunk in self.aws_entities.dump_chunks(consts.SEEN_ENTITIES_CHUNK_SIZE):
+                chunk_key = os.path.join(seen_entities_prefix, f"{len(self.seen_entities_chunks):05d}.json.gz")
+                compressed_chunk = gzip.compress(json.dumps(chunk).encode())
+                metrics.put("SeenEntitiesChunkSize", len(compressed_chunk), "Bytes")
+                aws_s3_client.put_object(Body=compressed_chunk, Bucket=self.bucket_name, Key=chunk_key)
+                self.seen_entities_chunks.append(chunk_key)
+        except Exception as e:
+            logger.warning(f"Failed to save seen entities, bucket: {self.bucket_name}, prefix: {seen_entities_prefix},"
+                           f" stale entities won't be deleted; {e}")
+            self.skip_delete = True
+
+        self.config["seen_entities_chunks"] = self.seen_entities_chunks
+        self.config["skip_delete"] = self.skip_delete
+
+    def _load_seen_entities(self):
+        aws_s3_client = get_client("s3")
+        for chunk_key in self.seen_entities_chunks:
+            try:
+                chunk = aws_s3_client.get_object(Bucket=self.bucket_name, Key=chunk_key)["Body"].read()
+                self.aws_entities.load_chunk(json.loads(gzip.decompress(chunk)))
+            except Exception as e:
+                logger.warning(f"Failed to load seen entities, bucket: {self.bucket_name}, key: {chunk_key},"
+                               f" stale entities won't be deleted; {e}")
+                self.skip_delete = True
+                return
+
+    def _delete_seen_entities(self):
+        delete_objects(self.bucket_name, self.seen_entities_chunks)
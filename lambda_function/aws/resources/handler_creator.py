@@ -1,22 +1,30 @@
+import functools
+import importlib
 from typing import Dict, Type
 
 from aws.resources.base_handler import BaseHandler
-from aws.resources.cloudcontrol_handler import CloudControlHandler
-from aws.resources.cloudformation_handler import CloudFormationHandler
-from aws.resources.ec2_instance_handler import EC2InstanceHandler
-from aws.resources.load_balancer_handler import LoadBalancerHandler
-from aws.resources.acm_cert_handler import ACMHandler
-from aws.resources.elasticache_cluster_handler import ElasticacheClusterHandler
-
-SPECIAL_AWS_HANDLERS: Dict[str, Type[BaseHandler]] = {
-    "AWS::CloudFormation::Stack": CloudFormationHandler,
-    "AWS::EC2::Instance": EC2InstanceHandler,
-    "AWS::ElasticLoadBalancingV2::LoadBalancer": LoadBalancerHandler,
-    "AWS::ACM::Certificate": ACMHandler,
-    "AWS::ElastiCache::CacheCluster": ElasticacheClusterHandler
+
+# Handler classes by import path, so only the handlers of the synced kinds are imported
+SPECIAL_AWS_HANDLERS: Dict[str, str] = {
+    "AWS::CloudFormation::Stack": "aws.resources.cloudformation_handler.CloudFormationHandler",
+    "AWS::EC2::Instance": "aws.resources.ec2_instance_handler.EC2InstanceHandler",
+    "AWS::ElasticLoadBalancingV2::LoadBalancer": "aws.resources.load_balancer_handler.LoadBalancerHandler",
+    "AWS::ACM::Certificate": "aws.resources.acm_cert_handler.ACMHandler",
+    "AWS::ElastiCache::CacheCluster": "aws.resources.elasticache_cluster_handler.ElasticacheClusterHandler"
 }
+DEFAULT_AWS_HANDLER = "aws.resources.cloudcontrol_handler.CloudControlHandler"
+
+
+@functools.lru_cache(maxsize=None)
+def import_handler_class(handler_path) -> Type[BaseHandler]:
+    module_path, _, class_name = handler_path.rpartition(".")
+    return getattr(importlib.import_module(module_path), class_name)
+
+
+def get_resource_handler_class(kind) -> Type[BaseHandler]:
+    return import_handler_class(SPECIAL_AWS_HANDLERS.get(kind, DEFAULT_AWS_HANDLER))
 
 
-def create_resource_handler(resource_config, port_client, lambda_context, default_region):
-    handler = SPECIAL_AWS_HANDLERS.get(resource_config['kind'], CloudControlHandler)
-    return handler(resource_config, port_client, lambda_context, default_region)
+def create_resource_handler(resource_config, port_client, lambda_context, default_region, pipeline=None):
+    handler = get_resource_handler_class(resource_config['kind'])
+    return handler(resource_config, port_client, lambda_context, default_region, pipeline)
@@ -0,0 +1,86 @@
+import logging
+import queue
+import threading
+from concurrent.futures import Future
+
+import consts
+from observability import metrics
+from port.entities import create_entities_json
+
+logger = logging.getLogger(__name__)
+
+
+class ResourcesPipeline:
+    # AWS fetch -> jq transform -> Port write, each stage with its own workers. The stages are connected by bounded
+    # queues, so a slow stage blocks the ones feeding it instead of piling up resources in memory
+    def __init__(self, entities_writer, fetch_workers=consts.PIPELINE_FETCH_WORKERS,
+                 transform_workers=consts.PIPELINE_TRANSFORM_WORKERS, write_workers=consts.PIPELINE_WRITE_WORKERS,
+                 queue_size=consts.PIPELINE_QUEUE_SIZE):
+        self.entities_writer = entities_writer
+        self._write_queue = queue.Queue(maxsize=queue_size)
+        self._transform_queue = queue.Queue(maxsize=queue_size)
+        self._fetch_queue = queue.Queue(maxsize=queue_size)
+        self._stages = [
+            self._start_stage("fetch", self._fetch_queue, self._fetch, self._transform_queue, fetch_workers),
+            self._start_stage("transform", self._transform_queue, self._transform, self._write_queue,
+                              transform_workers),
+            self._start_stage("write", self._write_queue, self._write, None, write_workers),
+        ]
+
+    def submit(self, handler, region, resource_id, action_type="upsert", resource_obj=None):
+        # Resolves to the handler result of the resource, once its entities are handed to the entities writer
+        future = Future()
+        self._fetch_queue.put({"handler": handler, "region": region, "resource_id": resource_id,
+                               "action_type": action_type, "resource_obj": resource_obj, "future": future})
+        return future
+
+    def close(self):
+        # Stages are stopped in order, so resources already submitted go through all of them
+        for stage_queue, threads in self._stages:
+            for _ in threads:
+                stage_queue.put(None)
+            for thread in threads:
+                thread.join()
+
+    def _start_stage(self, name, stage_queue, handle_item, next_queue, workers):
+        threads = [threading.Thread(target=self._run_stage, args=(name, stage_queue, handle_item, next_queue),
+                                    name=f"pipeline-{name}-{i}", daemon=True) for i in range(workers)]
+        for thread in threads:
+            thread.start()
+        return stage_queue, threads
+
+    def _run_stage(self, name, stage_queue, handle_item, next_queue):
+        while True:
+            item = stage_queue.get()
+            if item is None:
+                return
+
+            # Resources still waiting for the stage, a full queue means it is the bottleneck
+            metrics.put("PipelineQueueDepth", stage_queue.qsize(), "Count", Stage=name)
+            try:
+                with metrics.timer("PipelineStageDuration", Stage=name, Kind=item["handler"].kind):
+                    handle_item(item)
+            except Exception as e:
+                handler = item["handler"]
+                logger.error(f"Failed to extract or transform resource id: {item['resource_id']}, kind: {handler.kind},"
+                             f" error: {e}")
+                item["future"].set_result({"aws_entities": set(), "skip_delete": True, "error": e})
+                continue
+
+            if next_queue is not None:
+                next_queue.put(item)
+
+    @staticmethod
+    def _fetch(item):
+        item["resource_obj"] = item["handler"].fetch_resource(item["region"], item["resource_id"], item["action_type"],
+                                                              item["resource_obj"])
+
+    @staticmethod
+    def _transform(item):
+        handler = item["handler"]
+        item["entities"] = create_entities_json(item["resource_obj"], handler.selector_query, handler.mappings,
+                                                item["action_type"])
+
+    def _write(self, item):
+        aws_entities = self.entities_writer.write(item["entities"], item["action_type"])
+        item["future"].set_result({"aws_entities": aws_entities, "skip_delete": False})
@@ -0,0 +1,38 @@
+import threading
+
+import consts
+
+
+class TimeBudget:
+    # Estimates the time to list a page and to handle a resource from observed timings, so a handler does as much as
+    # fits in the time left of the Lambda invocation, instead of stopping at a fixed remaining time
+    def __init__(self, lambda_context, margin_ms=consts.TIME_BUDGET_SAFETY_MARGIN_MS):
+        self.lambda_context = lambda_context
+        self.margin_ms = margin_ms
+        self.page_ms = consts.TIME_BUDGET_INITIAL_PAGE_MS
+        self.item_ms = consts.TIME_BUDGET_INITIAL_ITEM_MS
+        self._lock = threading.Lock()
+
+    def get_remaining_ms(self):
+        # Time left once the margin for flushing entities, saving the checkpoint and re-invoking is kept aside
+        return self.lambda_context.get_remaining_time_in_millis() - self.margin_ms
+
+    def has_time_for_page(self):
+        # Listing a page is only worth it with time to handle at least one of its resources
+        return self.get_remaining_ms() > consts.TIME_BUDGET_ESTIMATE_FACTOR * (self.page_ms + self.item_ms)
+
+    def get_affordable_items(self):
+        return max(int(self.get_remaining_ms() / (consts.TIME_BUDGET_ESTIMATE_FACTOR * self.item_ms)), 0)
+
+    def record_page(self, elapsed_ms):
+        with self._lock:
+            self.page_ms = self._smooth(self.page_ms, elapsed_ms)
+
+    def record_items(self, count, elapsed_ms):
+        if count:
+            with self._lock:
+                self.item_ms = self._smooth(self.item_ms, elapsed_ms / count)
+
+    @staticmethod
+    def _smooth(estimate_ms, observed_ms):
+        return (1 - consts.TIME_BUDGET_SMOOTHING) * estimate_ms + consts.TIME_BUDGET_SMOOTHING * observed_ms
@@ -0,0 +1,24 @@
+import logging
+
+import consts
+from aws.clients import get_client
+
+logger = logging.getLogger(__name__)
+
+
+def list_objects(bucket_name, prefix):
+    paginator = get_client("s3").get_paginator("list_objects_v2")
+    return [s3_object for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix)
+            for s3_object in page.get("Contents", [])]
+
+
+def delete_objects(bucket_name, keys):
+    aws_s3_client = get_client("s3")
+    for i in range(0, len(keys), consts.S3_DELETE_OBJECTS_MAX_KEYS):
+        chunk_keys = keys[i:i + consts.S3_DELETE_OBJECTS_MAX_KEYS]
+        try:
+            aws_s3_client.delete_objects(Bucket=bucket_name,
+                                         Delete={"Objects": [{"Key": key} for key in chunk_keys], "Quiet": True})
+        except Exception as e:
+            logger.warning(f"Failed to delete {len(chunk_keys)} objects, bucket: {bucket_name},"
+                           f" first key: {chunk_keys[0]}; {e}")
@@ -1,13 +1,16 @@
 import json
 import logging
 import os
+import time
 
-import boto3
+import consts
+from aws.clients import get_client
 
 logger = logging.getLogger(__name__)
 
-aws_secretsmanager_client = boto3.client("secretsmanager")
-aws_s3_client = boto3.client("s3")
+# Kept across invocations of a warm Lambda container
+_config_files_cache = {}  # (bucket, key) -> (ETag, config file body)
+_secrets_cache = {}  # Secret ARN -> (expires at, secret string)
 
 
 def get_config(event, lambda_context):
@@ -26,8 +29,12 @@ def _get_resources_config(event, lambda_context):
     # Not supposed to happen. Just make sure to not accept the original config as next config, so it won't get deleted
     assert next_config_file_key != original_config_file_key, "next_config_file_key must not equal CONFIG_JSON_FILE_KEY"
 
-    config_json_file_key = next_config_file_key or original_config_file_key
-    config_from_s3 = json.loads(aws_s3_client.get_object(Bucket=bucket_name, Key=config_json_file_key)["Body"].read())
+    aws_s3_client = get_client("s3")
+
+    if next_config_file_key:  # Checkpoints are read once, so they aren't cached
+        config_from_s3 = json.loads(aws_s3_client.get_object(Bucket=bucket_name, Key=next_config_file_key)["Body"].read())
+    else:
+        config_from_s3 = json.loads(_get_cached_config_file(bucket_name, original_config_file_key))
 
     assert "resources" in config_from_s3, "resources key is missing from config file json"
 
@@ -40,11 +47,50 @@ def _get_resources_config(event, lambda_context):
     else:
         next_config_file_key = os.path.join(os.path.dirname(original_config_file_key), lambda_context.aws_request_id, "config.json")
 
-    s3_config = {"bucket_name": bucket_name, "next_config_file_key": next_config_file_key}
+    s3_config = {"bucket_name": bucket_name, "next_config_file_key": next_config_file_key,
+                 "entities_index_file_key": os.path.join(os.path.dirname(original_config_file_key),
+                                                         consts.ENTITIES_INDEX_FILE_NAME),
+                 "entities_index_changes_prefix": os.path.join(os.path.dirname(original_config_file_key),
+                                                               consts.ENTITIES_INDEX_CHANGES_DIR_NAME),
+                 "mapped_blueprints_file_key": os.path.join(os.path.dirname(original_config_file_key),
+                                                            consts.MAPPED_BLUEPRINTS_FILE_NAME),
+                 "fan_out_prefix": os.path.join(os.path.dirname(original_config_file_key), consts.FAN_OUT_DIR_NAME)}
 
     return {**config_from_s3, **s3_config}
 
 
+def _get_cached_config_file(bucket_name, config_file_key):
+    cache_key = (bucket_name, config_file_key)
+    cached_etag, cached_body = _config_files_cache.get(cache_key, (None, None))
+    get_object_params = {"Bucket": bucket_name, "Key": config_file_key}
+    if cached_etag:
+        get_object_params["IfNoneMatch"] = cached_etag
+
+    from botocore.exceptions import ClientError  # Imported on first use like boto3, to keep it out of the cold start
+
+    try:
+        response = get_client("s3").get_object(**get_object_params)
+    except ClientError as e:
+        if cached_etag and e.response.get("Error", {}).get("Code") in ("304", "NotModified"):
+            logger.info("Config file not modified, using the cached config")
+            return cached_body
+        raise
+
+    body = response["Body"].read()
+    _config_files_cache[cache_key] = (response.get("ETag"), body)
+    return body
+
+
+def _get_cached_secret_string(secret_arn):
+    expires_at, secret_string = _secrets_cache.get(secret_arn, (0, None))
+    if time.time() < expires_at:
+        return secret_string
+
+    secret_string = get_client("secretsmanager").get_secret_value(SecretId=secret_arn).get("SecretString", "{}")
+    _secrets_cache[secret_arn] = (time.time() + consts.SECRETS_CACHE_TTL_SECONDS, secret_string)
+    return secret_string
+
+
 def _get_port_credentials(event):
     if event.get("port_client_id"):
         return {
@@ -56,11 +102,7 @@ def _get_port_credentials(event):
         }
 
     secret_arn = os.getenv("PORT_CREDS_SECRET_ARN")
-    port_creds = json.loads(
-        aws_secretsmanager_client.get_secret_value(SecretId=secret_arn).get(
-            "SecretString", "{}"
-        )
-    )
+    port_creds = json.loads(_get_cached_secret_string(secret_arn))
     return {
         "port_client_id": port_creds["id"],
         "port_client_secret": port_creds["clientSecret"],
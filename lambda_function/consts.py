@@ -1,6 +1,57 @@
 PORT_API_URL = "https://api.getport.io/v1"
 PORT_AWS_EXPORTER_NAME = "port-aws-exporter"
-MAX_CC_WORKERS = 2 # To avoid AWS rate limit
-MAX_DEFAULT_AWS_WORKERS = 5
+MAX_DEFAULT_AWS_WORKERS = 10  # AWS calls are paced by the adaptive rate limiter
 MAX_PORT_WORKERS = 5
-REMAINING_TIME_TO_REINVOKE_THRESHOLD = 1000 * 60 * 7  # 7 minutes
+MAX_CONCURRENT_TRAVERSALS = 5  # Regions (and CloudControl resource models) listed concurrently
+MAX_CONCURRENT_RESOURCE_KINDS = 3  # Kinds of different AWS services synced concurrently
+PIPELINE_FETCH_WORKERS = 20  # Resources described from AWS concurrently, across all kinds
+PIPELINE_TRANSFORM_WORKERS = 2  # jq transforms are CPU bound, more threads only contend on the GIL
+PIPELINE_WRITE_WORKERS = 1  # Hand entities to the batch writer, which sends them with MAX_PORT_WORKERS threads
+PIPELINE_QUEUE_SIZE = 200  # Resources waiting between two stages, before the previous stage blocks
+PORT_MAX_IN_FLIGHT_BATCHES = 2 * MAX_PORT_WORKERS  # Batches queued or sent to Port, before the batch writer blocks
+PORT_MAX_RETRIES = 5
+PORT_TOKEN_EXPIRY_MARGIN_SECONDS = 60 * 20  # Longer than a Lambda invocation, so a token never expires mid run
+PORT_RETRY_BACKOFF_FACTOR = 0.5  # Seconds, doubled on every retry unless Port returns Retry-After
+PORT_BULK_BATCH_SIZE = 20  # Max entities per Port bulk request
+PORT_BULK_FLUSH_INTERVAL_SECONDS = 5
+EC2_DESCRIBE_INSTANCES_PAGE_SIZE = 1000  # Max allowed by EC2
+ELB_DESCRIBE_TAGS_MAX_ARNS = 20  # Max allowed by ELB
+AWS_RATE_LIMIT_INITIAL_RATE = 10.0  # Calls per second, per AWS service and region, when its quota isn't documented
+AWS_RATE_LIMIT_INITIAL_RATES = {"ec2": 20.0, "acm": 10.0, "elbv2": 10.0, "s3": 100.0, "secretsmanager": 100.0,
+                                "lambda": 100.0}  # Documented quotas of the services, lowered only once throttled
+AWS_RATE_LIMIT_MIN_RATE = 0.5
+AWS_RATE_LIMIT_MAX_RATE = 100.0
+AWS_RATE_LIMIT_INCREASE = 1.0  # Calls per second added for every second of successful calls
+AWS_RATE_LIMIT_DECREASE_FACTOR = 0.5
+AWS_RATE_LIMIT_DECREASE_COOLDOWN_SECONDS = 1.0
+AWS_NOT_FOUND_ERROR_CODE_SUFFIXES = ("NotFound", "NotFoundException", "NotFoundFault")  # Resources deleted since
+AWS_ACCESS_DENIED_ERROR_CODES = ("AccessDenied", "AccessDeniedException", "UnauthorizedOperation",
+                                 "AuthorizationError")  # Events failing with these would fail again when retried
+ENTITIES_INDEX_FILE_NAME = "entities_index.json.gz"  # Next to the config file in the bucket
+ENTITIES_INDEX_CHANGES_DIR_NAME = "entities_index_changes"  # Changes saved by every invocation, merged by a sync end
+MAPPED_BLUEPRINTS_FILE_NAME = "mapped_blueprints.json"  # Blueprints to search for stale entities, kept between runs
+ENTITIES_INDEX_MAX_AGE_SECONDS = 60 * 60 * 24  # Unchanged entities are still re-pushed once a day
+S3_DELETE_OBJECTS_MAX_KEYS = 1000  # Max allowed by S3 in a single delete_objects call
+SEEN_ENTITIES_CHUNK_SIZE = 10000  # Entities per compressed S3 object of the checkpoint
+PORT_SEARCH_PAGE_SIZE = 1000
+STALE_ENTITIES_DELETE_LIMIT = 5000  # Per run, in case most of the AWS resources were missed by mistake
+SECRETS_CACHE_TTL_SECONDS = 60 * 5  # Port credentials are re-read from Secrets Manager by warm containers
+TIME_BUDGET_SAFETY_MARGIN_MS = 1000 * 60  # Kept for flushing entities, saving the checkpoint and re-invoking
+TIME_BUDGET_INITIAL_PAGE_MS = 1000 * 5  # Estimates used until the first timings are observed
+TIME_BUDGET_INITIAL_ITEM_MS = 200
+TIME_BUDGET_ESTIMATE_FACTOR = 2  # Estimates are doubled, as timings vary between pages and resources
+TIME_BUDGET_SMOOTHING = 0.3  # Weight of the latest timing in the moving average of an estimate
+STALE_ENTITIES_DELETE_MIN_REMAINING_MS = 1000 * 60 * 3  # Otherwise the deletion is left to a new Lambda
+
+JQ_PROGRAMS_CACHE_SIZE = 1024  # Compiled jq programs kept per Lambda container
+FUSED_JQ_MAPPINGS = True  # Evaluate each mapping as a single jq program instead of a program per field
+
+METRICS_NAMESPACE = "PortAwsExporter"
+METRICS_MAX_VALUES_PER_LINE = 100  # Max values of a metric in a single EMF log line
+DEBUG_LOGS_SAMPLE_RATE = 0.01  # Share of the per resource and per entity debug logs that are written
+
+FAN_OUT_DIR_NAME = "fan_out"  # Next to the config file in the bucket, holds the state of fanned out syncs
+FAN_OUT_MAX_PARALLEL_SHARDS = 10  # Shards synced in parallel, each by its own chain of Lambda invocations
+FAN_OUT_SHARD_TIMEOUT_SECONDS = 60 * 20  # Longer than a Lambda invocation, the heartbeat is written by each one
+FAN_OUT_SHARD_MAX_ATTEMPTS = 2  # Times a shard is synced, before the run gives up on it and skips the deletion
+FAN_OUT_RUN_TIMEOUT_SECONDS = 60 * 60 * 6  # Scheduled runs start a new fanned out sync, once the one in progress is older
@@ -0,0 +1,94 @@
+import json
+import logging
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+import consts
+
+# Lines printed by different threads must not interleave, CloudWatch drops the lines it can't parse
+_print_lock = threading.Lock()
+
+
+class MetricsLogger:
+    # Metrics are printed as CloudWatch Embedded Metric Format log lines, which CloudWatch turns into metrics without
+    # any API call. Values are kept in memory, and printed on flush or once a metric reaches the max values of a line
+    def __init__(self, namespace=consts.METRICS_NAMESPACE):
+        self.namespace = namespace
+        self.default_dimensions = {}
+        self._values = defaultdict(list)  # (dimensions, metric name, unit) -> values
+        self._counters = defaultdict(float)  # (dimensions, metric name, unit) -> sum
+        self._lock = threading.Lock()
+
+    def set_default_dimensions(self, **dimensions):
+        self.default_dimensions = dimensions
+
+    def put(self, name, value, unit="Milliseconds", **dimensions):
+        metric_key = (tuple(sorted(dimensions.items())), name, unit)
+        with self._lock:
+            values = self._values[metric_key]
+            values.append(value)
+            full_values = self._values.pop(metric_key) if len(values) >= consts.METRICS_MAX_VALUES_PER_LINE else None
+        if full_values:
+            self._print(dimensions, {(name, unit): full_values})
+
+    def increment(self, name, value=1, unit="Count", **dimensions):
+        with self._lock:
+            self._counters[(tuple(sorted(dimensions.items())), name, unit)] += value
+
+    @contextmanager
+    def timer(self, name, **dimensions):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.put(name, (time.monotonic() - start) * 1000, "Milliseconds", **dimensions)
+
+    def flush(self):
+        with self._lock:
+            values, self._values = self._values, defaultdict(list)
+            counters, self._counters = self._counters, defaultdict(float)
+
+        metrics_by_dimensions = defaultdict(dict)
+        for (dimensions, name, unit), metric_values in values.items():
+            metrics_by_dimensions[dimensions][(name, unit)] = metric_values
+        for (dimensions, name, unit), total in counters.items():
+            metrics_by_dimensions[dimensions][(name, unit)] = [total]
+
+        for dimensions, metrics in metrics_by_dimensions.items():
+            self._print(dict(dimensions), metrics)
+
+    def _print(self, dimensions, metrics):
+        dimensions = {key: str(value) for key, value in {**self.default_dimensions, **dimensions}.items()}
+        line = {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": self.namespace,
+                    "Dimensions": [list(dimensions)],
+                    "Metrics": [{"Name": name, "Unit": unit} for name, unit in metrics],
+                }],
+            },
+            **dimensions,
+        }
+        for (name, _), metric_values in metrics.items():
+            metric_values = [round(value, 3) for value in metric_values]
+            line[name] = metric_values[0] if len(metric_values) == 1 else metric_values
+        # Printed rather than logged, the Lambda log format prefix would keep CloudWatch from parsing the JSON.
+        # Written at once, print writes the line and its new line separately
+        line_json = json.dumps(line) + "\n"
+        with _print_lock:
+            sys.stdout.write(line_json)
+            sys.stdout.flush()
+
+
+metrics = MetricsLogger()
+
+
+def log_sampled_debug(logger, message):
+    # For per resource and per entity logs, which would flood CloudWatch Logs on large accounts
+    if logger.isEnabledFor(logging.DEBUG) and random.random() < consts.DEBUG_LOGS_SAMPLE_RATE:
+        logger.debug(message)
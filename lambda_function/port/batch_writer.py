@@ -0,0 +1,167 @@
+import logging
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import consts
+from observability import metrics
+from port.entities import get_entities_waves, get_entity_relations_targets, handle_entity
+
+logger = logging.getLogger(__name__)
+
+
+class EntitiesBatchWriter:
+    def __init__(self, port_client, batch_size=consts.PORT_BULK_BATCH_SIZE,
+                 flush_interval=consts.PORT_BULK_FLUSH_INTERVAL_SECONDS, entities_index=None, skip_unchanged=True):
+        self.port_client = port_client
+        self.entities_index = entities_index
+        self.skip_unchanged = skip_unchanged
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.failed_entities = set()
+        self._failed_upsert_ids = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=consts.MAX_PORT_WORKERS)
+        self._pending_entities = []
+        self._pending_ids = set()
+        self._pending_action_type = None
+        self._pending_since = None
+        self._in_flight = {}  # Future of a sent batch -> identifiers of its entities
+        self._closed = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_periodically, daemon=True)
+        self._flusher.start()
+
+    def write(self, entities, action_type="upsert"):
+        with self._lock:
+            # Written in waves, so a batch waits for the one before it only when it holds the relation targets
+            for entity in [entity for wave in get_entities_waves(entities) for entity in wave]:
+                if action_type == "upsert" and self.skip_unchanged and self.entities_index and \
+                        self.entities_index.is_unchanged(entity):
+                    metrics.increment("EntitiesUnchanged", Blueprint=entity.get("blueprint"))
+                    continue
+
+                if action_type != self._pending_action_type or self._depends_on_unwritten(entity):
+                    # Keep the order between actions, and make sure relation targets exist before their dependents
+                    self._flush(wait_in_flight=True)
+                    self._pending_action_type = action_type
+
+                failed_targets = get_entity_relations_targets(entity) & self._failed_upsert_ids
+                if action_type == "upsert" and failed_targets:
+                    # Still sent, the targets may exist from previous syncs, and otherwise Port rejects the entity
+                    logger.warning(f"Entity: {entity.get('identifier')} of blueprint: {entity.get('blueprint')}"
+                                   f" relates to entities that failed to upsert: {sorted(failed_targets)}")
+                    metrics.increment("EntitiesWithFailedRelations", Blueprint=entity.get("blueprint"))
+
+                self._pending_entities.append(entity)
+                self._pending_ids.add(entity.get("identifier"))
+                self._pending_since = self._pending_since or time.monotonic()
+                if len(self._pending_entities) >= self.batch_size:
+                    self._flush()
+
+        return {f"{entity.get('blueprint')};{entity.get('identifier')}" for entity in entities}
+
+    def flush(self):
+        with self._lock:
+            self._flush(wait_in_flight=True)
+
+    def close(self):
+        self._closed.set()
+        self.flush()
+        self._executor.shutdown(wait=True)
+
+    def _depends_on_unwritten(self, entity):
+        self._in_flight = {future: ids for future, ids in self._in_flight.items() if not future.done()}
+        return any(target_id in self._pending_ids or any(target_id in ids for ids in self._in_flight.values())
+                   for target_id in get_entity_relations_targets(entity))
+
+    def _flush(self, wait_in_flight=False):
+        if self._pending_entities:
+            entities_by_blueprint = defaultdict(list)
+            for entity in self._pending_entities:
+                entities_by_blueprint[entity.get("blueprint")].append(entity)
+
+            for blueprint_id, entities in entities_by_blueprint.items():
+                for i in range(0, len(entities), self.batch_size):
+                    batch = entities[i:i + self.batch_size]
+                    self._wait_in_flight_below(consts.PORT_MAX_IN_FLIGHT_BATCHES)
+                    future = self._executor.submit(self._send_batch, blueprint_id, batch, self._pending_action_type)
+                    self._in_flight[future] = {entity.get("identifier") for entity in batch}
+                    metrics.put("PortBatchesInFlight", len(self._in_flight), "Count")
+
+            self._pending_entities = []
+            self._pending_ids = set()
+            self._pending_since = None
+
+        if wait_in_flight:
+            wait(list(self._in_flight))
+            self._in_flight = {}
+
+    def _wait_in_flight_below(self, max_in_flight):
+        # Backpressure, so entities are not piled up in memory while Port is slow
+        self._in_flight = {future: ids for future, ids in self._in_flight.items() if not future.done()}
+        while len(self._in_flight) >= max_in_flight:
+            wait(list(self._in_flight), return_when=FIRST_COMPLETED)
+            self._in_flight = {future: ids for future, ids in self._in_flight.items() if not future.done()}
+
+    def _flush_periodically(self):
+        while not self._closed.wait(self.flush_interval):
+            with self._lock:
+                if self._pending_since and time.monotonic() - self._pending_since >= self.flush_interval:
+                    self._flush()
+
+    def _send_batch(self, blueprint_id, entities, action_type):
+        try:
+            if action_type == "upsert":
+                errors = self.port_client.upsert_entities(blueprint_id, entities)
+            else:
+                errors = self.port_client.delete_entities(blueprint_id, entities)
+        except Exception as e:
+            status_code = getattr(getattr(e, "response", None), "status_code", None)
+            if not status_code or status_code == 429 or status_code >= 500:
+                # Already retried by the session, single entity requests would only add to the throttling
+                logger.error(f"Failed to {action_type} {len(entities)} entities of blueprint: {blueprint_id}"
+                             f" in bulk; {e}")
+                for entity in entities:
+                    self._add_failed(blueprint_id, entity.get("identifier"), action_type)
+                return
+
+            # Bulk requests aren't supported (404/405), or an entity of the batch is invalid
+            logger.warning(f"Failed to {action_type} {len(entities)} entities of blueprint: {blueprint_id} in bulk,"
+                           f" falling back to single entity requests; {e}")
+            for entity in entities:
+                if handle_entity(entity, self.port_client, action_type):
+                    self._record_handled(entity, action_type)
+                else:
+                    self._add_failed(blueprint_id, entity.get("identifier"), action_type)
+            return
+
+        failed_ids = set()
+        for error in errors:
+            identifier = error.get("identifier")
+            if identifier is None and isinstance(error.get("index"), int) and error["index"] < len(entities):
+                identifier = entities[error["index"]].get("identifier")
+            logger.error(
+                f"Failed to handle entity: {identifier} of blueprint: {blueprint_id}, action: {action_type};"
+                f" {error.get('message') or error.get('error')}"
+            )
+            self._add_failed(blueprint_id, identifier, action_type)
+            failed_ids.add(identifier)
+
+        for entity in entities:
+            if entity.get("identifier") not in failed_ids:
+                self._record_handled(entity, action_type)
+
+    def _add_failed(self, blueprint_id, identifier, action_type="upsert"):
+        metrics.increment("EntitiesFailed", Blueprint=blueprint_id, Action=action_type)
+        self.failed_entities.add(f"{blueprint_id};{identifier}")
+        if action_type == "upsert":  # Reported for the entities that relate to it
+            self._failed_upsert_ids.add(identifier)
+
+    def _record_handled(self, entity, action_type):
+        metrics.increment("EntitiesWritten", Blueprint=entity.get("blueprint"), Action=action_type)
+        if self.entities_index:
+            if action_type == "upsert":
+                self.entities_index.record_upserted(entity)
+            else:
+                self.entities_index.record_deleted(entity)
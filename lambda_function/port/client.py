@@ -1,35 +1,115 @@
 import logging
+import threading
+import time
 import urllib.parse
+from collections import defaultdict
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import consts
+from observability import log_sampled_debug, metrics
 
 logger = logging.getLogger(__name__)
 
+_session = None
+_session_lock = threading.Lock()
+# Access tokens by (api url, client id), reused by invocations of a warm Lambda container until close to expiry
+_tokens = {}
+_tokens_lock = threading.Lock()
+
+
+def get_session():
+    # Shared across invocations of a warm Lambda container, so connections are kept alive between them
+    global _session
+    with _session_lock:
+        if _session is None:
+            retry = Retry(
+                total=consts.PORT_MAX_RETRIES,
+                backoff_factor=consts.PORT_RETRY_BACKOFF_FACTOR,
+                status_forcelist=[429, 500, 502, 503, 504],
+                allowed_methods=None,  # Port upserts and deletes are idempotent, so POST requests are retried too
+                respect_retry_after_header=True,
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=consts.MAX_PORT_WORKERS + 1, max_retries=retry)
+            _session = requests.Session()
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+        return _session
+
 
 class PortClient:
     def __init__(self, client_id, client_secret, user_agent, api_url):
         self.api_url = api_url
+        self.session = get_session()
+        self.stats = defaultdict(lambda: {"requests": 0, "retries": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0})
+        self._stats_lock = threading.Lock()
         self.access_token = self.get_token(client_id, client_secret)
         self.headers = {
             "Authorization": f"Bearer {self.access_token}",
             "User-Agent": user_agent,
         }
 
+    def _request(self, method, endpoint, url, **kwargs):
+        start = time.monotonic()
+        response = None
+        try:
+            response = self.session.request(method, url, **kwargs)
+            return response
+        finally:
+            self._record_request(f"{method} {endpoint}", (time.monotonic() - start) * 1000, response)
+
+    def _record_request(self, endpoint, elapsed_ms, response):
+        retries = getattr(getattr(response, "raw", None), "retries", None)
+        metrics.put("PortRequestLatency", elapsed_ms, Endpoint=endpoint,
+                    Status=response.status_code if response is not None else "error")
+        if retries and retries.history:
+            metrics.increment("PortRequestRetries", len(retries.history), Endpoint=endpoint)
+        with self._stats_lock:
+            endpoint_stats = self.stats[endpoint]
+            endpoint_stats["requests"] += 1
+            endpoint_stats["retries"] += len(retries.history) if retries else 0
+            endpoint_stats["errors"] += 1 if response is None or not response.ok else 0
+            endpoint_stats["total_ms"] += elapsed_ms
+            endpoint_stats["max_ms"] = max(endpoint_stats["max_ms"], elapsed_ms)
+
+    def log_stats(self):
+        with self._stats_lock:
+            for endpoint, endpoint_stats in self.stats.items():
+                logger.info(
+                    f"Port API stats, endpoint: {endpoint}, requests: {endpoint_stats['requests']},"
+                    f" retries: {endpoint_stats['retries']}, errors: {endpoint_stats['errors']},"
+                    f" avg latency: {endpoint_stats['total_ms'] / endpoint_stats['requests']:.0f}ms,"
+                    f" max latency: {endpoint_stats['max_ms']:.0f}ms"
+                )
+
     def get_token(self, client_id, client_secret):
-        credentials = {"clientId": client_id, "clientSecret": client_secret}
-        token_response = requests.post(
-            f"{self.api_url}/auth/access_token", json=credentials
-        )
-        token_response.raise_for_status()
-        return token_response.json()["accessToken"]
+        token_key = (self.api_url, client_id)
+        with _tokens_lock:
+            access_token, expires_at = _tokens.get(token_key, (None, 0))
+            if access_token and time.time() < expires_at - consts.PORT_TOKEN_EXPIRY_MARGIN_SECONDS:
+                return access_token
+
+            credentials = {"clientId": client_id, "clientSecret": client_secret}
+            token_response = self._request(
+                "POST", "/auth/access_token", f"{self.api_url}/auth/access_token", json=credentials
+            )
+            token_response.raise_for_status()
+            token_json = token_response.json()
+            # Tokens without expiresIn aren't reused
+            expires_in = token_json.get("expiresIn", consts.PORT_TOKEN_EXPIRY_MARGIN_SECONDS)
+            _tokens[token_key] = (token_json["accessToken"], time.time() + expires_in)
+            return token_json["accessToken"]
 
     def upsert_entity(self, entity):
         blueprint_id = entity.get("blueprint")
         entity_to_upsert = {k: v for k, v in entity.items() if k != 'blueprint'}
-        logger.info(
-            f"Upsert entity: {entity_to_upsert.get('identifier')} of blueprint: {blueprint_id}"
-        )
-        requests.post(
+        log_sampled_debug(logger, f"Upsert entity: {entity_to_upsert.get('identifier')} of blueprint: {blueprint_id}")
+        self._request(
+            "POST",
+            "/blueprints/{blueprint}/entities",
             f'{self.api_url}/blueprints/{urllib.parse.quote(blueprint_id, safe="")}/entities',
             json=entity_to_upsert,
             headers=self.headers,
@@ -39,15 +119,45 @@ class PortClient:
     def delete_entity(self, entity):
         blueprint_id = entity.get("blueprint")
         entity_id = entity.get("identifier")
-        logger.info(f"Delete entity: {entity_id} of blueprint: {blueprint_id}")
-        requests.delete(
+        log_sampled_debug(logger, f"Delete entity: {entity_id} of blueprint: {blueprint_id}")
+        self._request(
+            "DELETE",
+            "/blueprints/{blueprint}/entities/{identifier}",
             f'{self.api_url}/blueprints/{urllib.parse.quote(blueprint_id, safe="")}/entities/{urllib.parse.quote(entity_id, safe="")}',
             headers=self.headers,
             params={"delete_dependents": "true"},
         ).raise_for_status()
 
+    def upsert_entities(self, blueprint_id, entities):
+        log_sampled_debug(logger, f"Upsert {len(entities)} entities of blueprint: {blueprint_id}")
+        response = self._request(
+            "POST",
+            "/blueprints/{blueprint}/entities/bulk",
+            f'{self.api_url}/blueprints/{urllib.parse.quote(blueprint_id, safe="")}/entities/bulk',
+            json={"entities": [{k: v for k, v in entity.items() if k != 'blueprint'} for entity in entities]},
+            headers=self.headers,
+            params={"upsert": "true", "merge": "true"},
+        )
+        response.raise_for_status()
+        return response.json().get("errors", [])
+
+    def delete_entities(self, blueprint_id, entities):
+        log_sampled_debug(logger, f"Delete {len(entities)} entities of blueprint: {blueprint_id}")
+        response = self._request(
+            "DELETE",
+            "/blueprints/{blueprint}/bulk/entities",
+            f'{self.api_url}/blueprints/{urllib.parse.quote(blueprint_id, safe="")}/bulk/entities',
+            json={"entities": [entity.get("identifier") for entity in entities]},
+            headers=self.headers,
+            params={"delete_dependents": "true"},
+        )
+        response.raise_for_status()
+        return response.json().get("errors", [])
+
     def search_entities(self, query):
-        search_req = requests.post(
+        search_req = self._request(
+            "POST",
+            "/entities/search",
             f"{self.api_url}/entities/search",
             json=query,
             headers=self.headers,
@@ -59,11 +169,27 @@ class PortClient:
         search_req.raise_for_status()
         return search_req.json()["entities"]
 
+    def search_blueprint_entities(self, blueprint_id, query, next_page=None):
+        body = {"query": query, "limit": consts.PORT_SEARCH_PAGE_SIZE, "include": ["blueprint", "identifier"]}
+        if next_page:
+            body["from"] = next_page
+        search_req = self._request(
+            "POST",
+            "/blueprints/{blueprint}/entities/search",
+            f'{self.api_url}/blueprints/{urllib.parse.quote(blueprint_id, safe="")}/entities/search',
+            json=body,
+            headers=self.headers,
+            params={"exclude_calculated_properties": "true"},
+        )
+        search_req.raise_for_status()
+        search_response = search_req.json()
+        return search_response["entities"], search_response.get("next")
+
     def upsert_integration(self, integration):
         logger.info(
             f"Upsert integration: {integration.get('installationId')}"
         )
-        requests.post(f'{self.api_url}/integration',
+        self._request("POST", "/integration", f'{self.api_url}/integration',
                       json=integration,
                       headers=self.headers,
                       params={"upsert": "true"},
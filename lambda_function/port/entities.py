@@ -1,39 +1,56 @@
+import functools
+import json
 import logging
-from concurrent.futures import ThreadPoolExecutor
-
-import jq
+import re
+from collections import defaultdict
 
 import consts
+from observability import metrics
+from port.jq_analysis import get_jq_query_input_keys
 
 logger = logging.getLogger(__name__)
 
 
-def handle_entities(entities, port_client, action_type="upsert"):
-    def handle_concurrently(entities_to_handle):
-        if entities_to_handle:
-            with ThreadPoolExecutor(
-                    max_workers=min(len(entities_to_handle), consts.MAX_PORT_WORKERS)) as executor:
-                executor.map(lambda p: handle_entity(*p),
-                             [(e, port_client, action_type) for e in entities_to_handle])
-
-    if entities:
-        not_dependent_entities = []
-        not_dependent_entity_ids = set()
-        for entity in entities:
-            if not any(target_id in not_dependent_entity_ids
-                       for target in entity.get('relations', {}).values()
-                       for target_id in (target if isinstance(target, list) else [target])):
-                not_dependent_entities.append(entity)
-                not_dependent_entity_ids.add(entity.get('identifier'))
-            else:
-                handle_concurrently(not_dependent_entities)
-                handle_entity(entity, port_client, action_type)
-                not_dependent_entities = []
-                not_dependent_entity_ids = set()
+def get_entity_relations_targets(entity):
+    return {target_id for target in (entity.get('relations') or {}).values()
+            for target_id in (target if isinstance(target, list) else [target]) if isinstance(target_id, str)}
+
+
+def get_entities_waves(entities):
+    # Topological waves of the entities by their relations, entities only relate to entities of previous waves.
+    # Relations to entities outside the given ones are ignored, they are expected to exist already
+    indexes_by_id = defaultdict(list)
+    for index, entity in enumerate(entities):
+        indexes_by_id[entity.get('identifier')].append(index)
+
+    dependents = defaultdict(list)
+    dependencies_count = [0] * len(entities)
+    for index, entity in enumerate(entities):
+        for target_id in get_entity_relations_targets(entity):
+            for target_index in indexes_by_id.get(target_id, []):
+                if target_index != index:
+                    dependents[target_index].append(index)
+                    dependencies_count[index] += 1
 
-        handle_concurrently(not_dependent_entities)
+    waves = []
+    wave = [index for index, count in enumerate(dependencies_count) if not count]
+    while wave:
+        waves.append([entities[index] for index in wave])
+        next_wave = []
+        for index in wave:
+            for dependent_index in dependents[index]:
+                dependencies_count[dependent_index] -= 1
+                if not dependencies_count[dependent_index]:
+                    next_wave.append(dependent_index)
+        wave = next_wave
 
-    return {f"{entity.get('blueprint')};{entity.get('identifier')}" for entity in entities}
+    cyclic_entities = [entities[index] for index, count in enumerate(dependencies_count) if count]
+    if cyclic_entities:
+        logger.warning(f"Found a relations cycle between entities: "
+                       f"{sorted(entity.get('identifier') for entity in cyclic_entities)}, handling them last")
+        waves.append(cyclic_entities)
+
+    return waves
 
 
 def handle_entity(entity, port_client, action_type="upsert"):
@@ -42,17 +59,106 @@ def handle_entity(entity, port_client, action_type="upsert"):
             port_client.upsert_entity(entity)
         elif action_type == "delete":
             port_client.delete_entity(entity)
+        return True
     except Exception as e:
         logger.error(
             f"Failed to handle entity: {entity.get('identifier')} of blueprint: {entity.get('blueprint')}, action: {action_type}; {e}"
         )
+        return False
+
+
+@functools.lru_cache(maxsize=consts.JQ_PROGRAMS_CACHE_SIZE)
+def compile_jq_query(jq_query):
+    import jq  # Imported with the first compiled program, so cold starts that don't transform skip it
+    return jq.compile(jq_query)
+
+
+def get_entities_jq_queries(selector_jq_query, jq_mappings):
+    jq_queries = [selector_jq_query] + [
+        jq_query
+        for mapping in jq_mappings
+        for jq_query in [mapping.get("itemsToParse"), mapping.get("identifier"), mapping.get("title"),
+                         mapping.get("icon"), mapping.get("team"), *mapping.get("properties", {}).values(),
+                         *mapping.get("relations", {}).values()]
+    ]
+    return [jq_query for jq_query in jq_queries if jq_query]
+
+
+def get_jq_queries_referenced_keys(jq_queries):
+    # Over approximates the keys the queries read, every name in the queries counts as a key.
+    # Returns None when a query may read the whole input, so nothing can be left out of it
+    referenced_keys = set()
+    for jq_query in jq_queries:
+        if get_jq_query_input_keys(jq_query) is None:
+            return None
+        referenced_keys.update(re.findall(r"[A-Za-z_]\w*", jq_query))
+    return referenced_keys
+
+
+def get_jq_queries_top_level_keys(jq_queries):
+    # Over approximates the keys of the input the queries read.
+    # Returns None when a query may read the whole input, or can't be analysed, so every key may be needed
+    top_level_keys = set()
+    for jq_query in jq_queries:
+        jq_query_keys = get_jq_query_input_keys(jq_query)
+        if jq_query_keys is None:
+            return None
+        top_level_keys.update(jq_query_keys)
+    return top_level_keys
+
+
+def get_mappings_blueprints(jq_mappings):
+    return {mapping.get("blueprint", "").strip('"') for mapping in jq_mappings if mapping.get("blueprint")}
+
+
+def compile_entities_jq_queries(selector_jq_query, jq_mappings):
+    for jq_query in get_entities_jq_queries(selector_jq_query, jq_mappings):
+        try:
+            compile_jq_query(jq_query)
+        except Exception as e:
+            # Invalid queries still fail per resource once evaluated, same as before
+            logger.warning(f"Failed to compile jq query: {jq_query}; {e}")
+    if consts.FUSED_JQ_MAPPINGS:
+        for mapping in jq_mappings:
+            compile_fused_jq_query(build_fused_mapping_jq_query(mapping))
+
+
+@functools.lru_cache(maxsize=consts.JQ_PROGRAMS_CACHE_SIZE)
+def compile_fused_jq_query(fused_jq_query):
+    import jq
+    try:
+        return jq.compile(fused_jq_query)
+    except Exception as e:
+        # Fall back to evaluating every field on its own, which reports the failing field
+        logger.warning(f"Failed to compile fused mapping jq query, falling back to per field evaluation; {e}")
+        return None
+
+
+def build_fused_mapping_jq_query(mapping):
+    # Every field is wrapped with try/catch so a single field error doesn't fail the whole program:
+    # a successful field evaluates to [value], an empty one to [] and a failed one to {"error": ...}.
+    # The query is followed by a new line, so a trailing jq comment won't swallow the closing parenthesis
+    def field_query(jq_query):
+        return f'(try [first(({jq_query}\n))] catch {{"error": .}})'
+
+    def object_query(fields):
+        return "{" + ", ".join(f"{json.dumps(key)}: {field_query(jq_query)}" for key, jq_query in fields.items()) + "}"
+
+    fields = {"identifier": mapping.get("identifier", "null")}
+    for field in ["title", "icon", "team"]:
+        if mapping.get(field):
+            fields[field] = mapping[field]
+
+    return (f'{{"fields": {object_query(fields)}, '
+            f'"properties": {object_query(mapping.get("properties", {}))}, '
+            f'"relations": {object_query(mapping.get("relations", {}))}}}')
 
 
 def create_entities_json(
         resource_object, selector_jq_query, jq_mappings, action_type="upsert"
 ):
     def run_jq_query(jq_query):
-        return jq.first(jq_query, resource_object)
+        return compile_jq_query(jq_query).input(resource_object).first()
 
     def dedup_list(lst):
         return [dict(tup) for tup in {tuple(obj.items()) for obj in lst}]
@@ -74,21 +180,27 @@ def create_entities_json(
 
     entities = []
     for mapping in jq_mappings:
-        items_to_parse = mapping.get('itemsToParse')
-        if items_to_parse:
-            items = run_jq_query(items_to_parse)
-            items = items if isinstance(items, list) else []
-            for item in items:
-                entities.append(create_upsert_entity_json(mapping, resource_object | {'item': item}))
-        else:
-            entities.append(create_upsert_entity_json(mapping, resource_object))
+        with metrics.timer("JqTransformDuration", Blueprint=mapping.get("blueprint", "").strip('"')):
+            items_to_parse = mapping.get('itemsToParse')
+            if items_to_parse:
+                items = run_jq_query(items_to_parse)
+                items = items if isinstance(items, list) else []
+                for item in items:
+                    entities.append(create_upsert_entity_json(mapping, resource_object | {'item': item}))
+            else:
+                entities.append(create_upsert_entity_json(mapping, resource_object))
 
     return entities
 
 
 def create_upsert_entity_json(mapping, resource_object):
+    if consts.FUSED_JQ_MAPPINGS:
+        fused_program = compile_fused_jq_query(build_fused_mapping_jq_query(mapping))
+        if fused_program:
+            return create_upsert_entity_json_fused(fused_program, mapping, resource_object)
+
     def run_jq_query(jq_query):
-        return jq.first(jq_query, resource_object)
+        return compile_jq_query(jq_query).input(resource_object).first()
 
     return {
         k: v
@@ -113,6 +225,42 @@ def create_upsert_entity_json(mapping, resource_object):
     }
 
 
+def create_upsert_entity_json_fused(fused_program, mapping, resource_object):
+    def field_value(field, field_jq_query, result):
+        if isinstance(result, dict):
+            raise Exception(
+                f"Failed to evaluate jq query for entity, field: {field}, query: {field_jq_query}; {result.get('error')}")
+        if not result:
+            raise Exception(f"Empty jq query result for entity, field: {field}, query: {field_jq_query}")
+        return result[0]
+
+    fused_result = fused_program.input(resource_object).first()
+    fields = fused_result["fields"]
+
+    entity = {
+        "identifier": field_value("identifier", mapping.get("identifier", "null"), fields["identifier"])
+                      or raise_missing_exception("identifier", mapping)
+    }
+    if "title" in fields:
+        entity["title"] = field_value("title", mapping["title"], fields["title"])
+    entity["blueprint"] = mapping.get("blueprint", "").strip('"') or raise_missing_exception("blueprint", mapping)
+    for field in ["icon", "team"]:
+        if field in fields:
+            entity[field] = field_value(field, mapping[field], fields[field])
+    entity["properties"] = {
+        prop_key: field_value(f"properties.{prop_key}", prop_val, fused_result["properties"][prop_key])
+        for prop_key, prop_val in mapping.get("properties", {}).items()
+    }
+    relations = {
+        rel_key: field_value(f"relations.{rel_key}", rel_val, fused_result["relations"][rel_key])
+        for rel_key, rel_val in mapping.get("relations", {}).items()
+    }
+    if relations:
+        entity["relations"] = relations
+
+    return {k: v for k, v in entity.items() if v is not None}
+
+
 def raise_missing_exception(missing_field, mapping):
     raise Exception(
         f"Missing required field value for entity, field: {missing_field}, mapping: {mapping.get(missing_field)}"
@@ -0,0 +1,135 @@
+import gzip
+import hashlib
+import json
+import logging
+import threading
+import time
+import uuid
+
+import consts
+from aws.clients import get_client
+from aws.s3 import delete_objects, list_objects
+
+logger = logging.getLogger(__name__)
+
+
+class EntitiesIndex:
+    # Content hash of the last entity successfully pushed to Port per "blueprint;identifier", kept in S3 between runs.
+    # Invocations that may run concurrently, like the shards of a fanned out sync, save their changes to objects of
+    # their own under changes_prefix, which are merged into the index once a sync is done.
+    # The index is loaded on first use, invocations that don't skip unchanged entities don't load it
+    def __init__(self, bucket_name, file_key, changes_prefix, max_age_seconds=consts.ENTITIES_INDEX_MAX_AGE_SECONDS):
+        self.bucket_name = bucket_name
+        self.file_key = file_key
+        self.changes_prefix = changes_prefix
+        self.max_age_seconds = max_age_seconds
+        self._entries = None  # "blueprint;identifier" -> [entity hash, pushed at (epoch seconds)]
+        self._changes = {}  # "blueprint;identifier" -> entry, or None when deleted, since the index was loaded
+        self._loaded_changes_keys = []
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_entity_key(entity):
+        return f"{entity.get('blueprint')};{entity.get('identifier')}"
+
+    @staticmethod
+    def get_entity_hash(entity):
+        entity_json = json.dumps(entity, sort_keys=True, separators=(",", ":"), default=str)
+        return hashlib.blake2b(entity_json.encode(), digest_size=8).hexdigest()
+
+    def is_unchanged(self, entity):
+        self._ensure_loaded()
+        entry = self._entries.get(self.get_entity_key(entity))
+        if not entry or entry[0] != self.get_entity_hash(entity):
+            return False
+        # Entities are re-pushed once in a while, in case they were changed or deleted in Port directly
+        return not self.max_age_seconds or time.time() - entry[1] < self.max_age_seconds
+
+    # Writes are recorded without loading the index, so events, which don't skip unchanged entities, keep it current
+    def record_upserted(self, entity):
+        with self._lock:
+            entity_key = self.get_entity_key(entity)
+            self._changes[entity_key] = [self.get_entity_hash(entity), int(time.time())]
+            if self._entries is not None:
+                self._entries[entity_key] = self._changes[entity_key]
+
+    def record_deleted(self, entity):
+        with self._lock:
+            entity_key = self.get_entity_key(entity)
+            if self._entries is None or self._entries.pop(entity_key, None) or entity_key in self._changes:
+                self._changes[entity_key] = None
+
+    def save(self):
+        with self._lock:
+            if not self._changes:
+                return
+            changes, self._changes = self._changes, {}
+
+        # Named by time, so changes are applied in the order they were saved
+        changes_key = f"{self.changes_prefix}/{int(time.time() * 1000):013d}-{uuid.uuid4().hex}.json.gz"
+        try:
+            get_client("s3").put_object(Body=gzip.compress(json.dumps(changes, separators=(",", ":")).encode()),
+                                        Bucket=self.bucket_name, Key=changes_key)
+        except Exception as e:
+            logger.warning(f"Failed to save entities index changes, bucket: {self.bucket_name}, key: {changes_key};"
+                           f" {e}")
+
+    def compact(self):
+        # Merges the saved changes into the index, by the invocation ending a sync when no other sync is running
+        self._ensure_loaded()
+        with self._lock:
+            changes, self._changes = self._changes, {}
+            loaded_changes_keys, self._loaded_changes_keys = self._loaded_changes_keys, []
+            body = gzip.compress(json.dumps(self._entries, separators=(",", ":")).encode())
+
+        try:
+            get_client("s3").put_object(Body=body, Bucket=self.bucket_name, Key=self.file_key)
+        except Exception as e:
+            logger.warning(f"Failed to save entities index, bucket: {self.bucket_name}, key: {self.file_key}; {e}")
+            with self._lock:
+                self._changes = {**changes, **self._changes}
+                self._loaded_changes_keys = loaded_changes_keys + self._loaded_changes_keys
+            self.save()
+            return
+        delete_objects(self.bucket_name, loaded_changes_keys)
+
+    def _ensure_loaded(self):
+        if self._entries is None:
+            with self._lock:
+                if self._entries is None:
+                    self._entries = self._load()
+
+    def _load(self):
+        aws_s3_client = get_client("s3")
+        entries = {}
+        try:
+            entries = self._read(aws_s3_client, self.file_key)
+        except aws_s3_client.exceptions.NoSuchKey:
+            logger.info("Entities index not found, all entities will be pushed to Port")
+        except Exception as e:
+            logger.warning(f"Failed to load entities index, bucket: {self.bucket_name}, key: {self.file_key},"
+                           f" all entities will be pushed to Port; {e}")
+            return {}
+
+        try:
+            changes_keys = sorted(s3_object["Key"] for s3_object in list_objects(self.bucket_name,
+                                                                                 f"{self.changes_prefix}/"))
+            for changes_key in changes_keys:
+                for entity_key, entry in self._read(aws_s3_client, changes_key).items():
+                    if entry:
+                        entries[entity_key] = entry
+                    else:
+                        entries.pop(entity_key, None)
+        except Exception as e:
+            # Deletions of the missing changes could be missed, so unchanged entities can't be told apart
+            logger.warning(f"Failed to load entities index changes, bucket: {self.bucket_name},"
+                           f" prefix: {self.changes_prefix}, all entities will be pushed to Port; {e}")
+            return {}
+
+        self._loaded_changes_keys = changes_keys
+        logger.info(f"Loaded entities index with {len(entries)} entities, and {len(changes_keys)} saved changes")
+        return entries
+
+    def _read(self, aws_s3_client, key):
+        body = aws_s3_client.get_object(Bucket=self.bucket_name, Key=key)["Body"].read()
+        return json.loads(gzip.decompress(body))
@@ -0,0 +1,233 @@
+import re
+
+# Finds the keys of its input a jq query reads, so resources can be left without keys no query reads. A query
+# that may read any key of its input, or that can't be analysed with confidence, has None as its keys.
+# Once a query passes the analysis its input never flows through a pipe as is (`.`, `..` and builtins that return
+# or iterate their input are rejected), so the right side of a pipe only reads values derived from the input
+JQ_TOKEN_PATTERN = re.compile(r'''
+    (?P<space>\s+|\#[^\n]*)
+    |(?P<recurse>\.\.)
+    |(?P<field>\.[A-Za-z_]\w*)
+    |(?P<quoted_field>\.(?="))
+    |(?P<dot>\.)
+    |(?P<variable>\$[A-Za-z_]\w*)
+    |(?P<format>@[A-Za-z_]\w*)
+    |(?P<ident>[A-Za-z_]\w*(?:::[A-Za-z_]\w*)*)
+    |(?P<number>\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)
+    |(?P<string>")
+    |(?P<op>\?//|//=|\|=|\+=|-=|\*=|/=|%=|==|!=|<=|>=|//|[|,;:+\-*/%<>=()\[\]{}?])
+''', re.VERBOSE)
+JQ_KEYWORDS = {"as", "def", "if", "then", "elif", "else", "end", "reduce", "foreach", "try", "catch", "label",
+               "import", "include", "and", "or", "__loc__", "break", "true", "false", "null"}
+# Builtins that don't read their input, by the numbers of arguments they're allowed with. Their outputs only
+# derive from their arguments, which are analysed as well
+INPUT_INDEPENDENT_JQ_BUILTINS = {"empty": {0}, "not": {0}, "type": {0}, "now": {0}, "env": {0}, "input": {0},
+                                 "inputs": {0}, "input_line_number": {0}, "builtins": {0}, "infinite": {0},
+                                 "nan": {0}, "halt": {0}, "error": {1}, "range": {1, 2, 3}, "first": {1},
+                                 "last": {1}, "limit": {2}, "isempty": {1}, "any": {2}, "all": {2}, "add": {1},
+                                 "path": {1}}
+
+JQ_FRAME_CLOSERS = {"group": ")", "index": "]", "array": "]", "object": "}"}
+
+
+class JqAnalysisError(Exception):
+    pass
+
+
+def get_jq_query_input_keys(jq_query):
+    try:
+        return _get_input_keys(_tokenize(jq_query), reads_input=True)
+    except JqAnalysisError:
+        return None
+
+
+def _tokenize(jq_query):
+    tokens = []
+    position = 0
+    while position < len(jq_query):
+        match = JQ_TOKEN_PATTERN.match(jq_query, position)
+        if not match:
+            raise JqAnalysisError(f"Unexpected character at {position}")
+        kind = match.lastgroup
+        if kind in ("string", "quoted_field"):
+            string_start = match.end() if kind == "string" else match.end() + 1
+            position, value, interpolations = _scan_string(jq_query, string_start)
+            tokens.append(("field" if kind == "quoted_field" else "string", value, interpolations))
+            continue
+        if kind != "space":
+            value = match.group()[1:] if kind == "field" else match.group()
+            tokens.append((kind, value, []))
+        position = match.end()
+    return tokens
+
+
+def _scan_string(jq_query, position):
+    # Scans a string from after its opening quote. Returns the position after its closing quote, its value (None
+    # when interpolated) and the tokens of its interpolations
+    value = []
+    interpolations = []
+    while position < len(jq_query):
+        char = jq_query[position]
+        if char == '"':
+            return position + 1, None if interpolations else "".join(value), interpolations
+        if char == "\\" and jq_query[position + 1:position + 2] == "(":
+            end = _find_interpolation_end(jq_query, position + 2)
+            interpolations.append(_tokenize(jq_query[position + 2:end]))
+            position = end + 1
+        elif char == "\\":
+            value.append(jq_query[position:position + 2])
+            position += 2
+        else:
+            value.append(char)
+            position += 1
+    raise JqAnalysisError("Unterminated string")
+
+
+def _find_interpolation_end(jq_query, position):
+    depth = 1
+    while position < len(jq_query):
+        char = jq_query[position]
+        if char == '"':
+            position = _scan_string(jq_query, position + 1)[0]
+            continue
+        depth += {"(": 1, ")": -1}.get(char, 0)
+        if not depth:
+            return position
+        position += 1
+    raise JqAnalysisError("Unterminated string interpolation")
+
+
+def _is_postfix(token):
+    # Whether a path or an index following the token applies to its value, rather than to the input
+    if token is None:
+        return False
+    kind, value, _ = token
+    return (kind in ("field", "string", "number", "variable") or (kind == "ident" and value not in JQ_KEYWORDS)
+            or (kind == "op" and value in (")", "]", "}", "?")))
+
+
+def _get_input_keys(tokens, reads_input):
+    # reads_input of a frame tells whether its input may still be the analysed input, a frame per bracket and if
+    keys = set()
+    frames = [{"kind": "", "reads_input": reads_input, "base_reads_input": reads_input, "binds": False}]
+
+    def read(key):
+        if frames[-1]["reads_input"]:
+            if key is None:
+                raise JqAnalysisError("Dynamic key")
+            keys.add(key)
+
+    def read_all():
+        if frames[-1]["reads_input"]:
+            raise JqAnalysisError("Reads the whole input")
+
+    def push(kind):
+        frames.append({"kind": kind, "reads_input": frames[-1]["reads_input"],
+                       "base_reads_input": frames[-1]["reads_input"], "binds": False,
+                       "expects_key": kind == "object", "index_tokens": [], "dot_index": False})
+
+    for position, token in enumerate(tokens):
+        kind, value, interpolations = token
+        previous = tokens[position - 1] if position else None
+        following = tokens[position + 1] if position + 1 < len(tokens) else (None, None, [])
+        frame = frames[-1]
+        if frame["kind"] == "index":
+            frame["index_tokens"].append(token)
+
+        if frame["kind"] == "object" and frame["expects_key"] and (kind, value) != ("op", "}"):
+            frame["expects_key"] = False
+            for interpolation in interpolations:
+                keys.update(_get_input_keys(interpolation, frame["reads_input"]))
+            if (kind, value) == ("op", "("):  # Key computed from an expression
+                push("group")
+                continue
+            if following[:2] == ("op", ":"):
+                continue  # Key of the object
+            if kind in ("ident", "string"):  # Shorthand of {key: .key}
+                read(value)
+                continue
+            if kind == "variable":  # Shorthand of {$name: $name}
+                continue
+            if kind == "format":
+                read_all()
+                continue
+            raise JqAnalysisError(f"Unexpected object key: {value}")
+
+        for interpolation in interpolations:  # Interpolated strings and quoted fields
+            keys.update(_get_input_keys(interpolation, frame["reads_input"]))
+
+        if kind == "field":
+            if not _is_postfix(previous):
+                read(value)
+        elif kind == "dot":
+            if following[:2] != ("op", "[") and not _is_postfix(previous):
+                read_all()
+        elif kind == "recurse":
+            read_all()
+        elif kind == "format":
+            if following[0] != "string":
+                read_all()
+        elif kind == "ident":
+            if value in ("def", "import", "include"):
+                raise JqAnalysisError(f"Unsupported keyword: {value}")
+            if value == "if":
+                push("if")
+            elif value in ("then", "elif", "else"):
+                if frame["kind"] != "if":
+                    raise JqAnalysisError(f"Unexpected keyword: {value}")
+                frame["reads_input"], frame["binds"] = frame["base_reads_input"], False
+            elif value == "end":
+                if frame["kind"] != "if":
+                    raise JqAnalysisError("Unexpected keyword: end")
+                frames.pop()
+            elif value in ("as", "label"):
+                frame["binds"] = True  # The input of the body after the binding is the input of the binding
+            elif value not in JQ_KEYWORDS:
+                arguments_count = _get_arguments_count(tokens, position + 1) if following[:2] == ("op", "(") else 0
+                if arguments_count not in INPUT_INDEPENDENT_JQ_BUILTINS.get(value, set()):
+                    read_all()
+        elif kind == "op" and value in ("(", "[", "{"):
+            follows_dot = previous is not None and previous[0] == "dot"
+            if value == "[" and (_is_postfix(previous) or follows_dot):
+                push("index")
+                frames[-1]["dot_index"] = follows_dot and not _is_postfix(tokens[position - 2] if position > 1 else None)
+            else:
+                push({"(": "group", "[": "array", "{": "object"}[value])
+        elif kind == "op" and value in (")", "]", "}"):
+            closed = frames.pop() if len(frames) > 1 else None
+            if not closed or JQ_FRAME_CLOSERS.get(closed["kind"]) != value:
+                raise JqAnalysisError(f"Unbalanced: {value}")
+            if closed["dot_index"]:
+                index_tokens = closed["index_tokens"][:-1]
+                if len(index_tokens) == 1 and index_tokens[0][0] == "string":
+                    read(index_tokens[0][1])
+                elif not (len(index_tokens) == 1 and index_tokens[0][0] == "number"):
+                    read_all()
+        elif kind == "op" and value == "|":
+            if not frame["binds"]:
+                frame["reads_input"] = False
+            frame["binds"] = False
+        elif kind == "op" and value in (",", ":") and frame["kind"] == "object":
+            frame["reads_input"] = frame["base_reads_input"]
+            frame["expects_key"] = value == ","
+
+    if len(frames) != 1:
+        raise JqAnalysisError("Unbalanced query")
+    return keys
+
+
+def _get_arguments_count(tokens, position):
+    depth = 0
+    arguments_count = 1
+    for kind, value, _ in tokens[position:]:
+        if kind != "op":
+            continue
+        if value in ("(", "[", "{"):
+            depth += 1
+        elif value in (")", "]", "}"):
+            depth -= 1
+            if not depth:
+                return arguments_count
+        elif value == ";" and depth == 1:
+            arguments_count += 1
+    raise JqAnalysisError("Unbalanced arguments")
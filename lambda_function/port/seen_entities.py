@@ -0,0 +1,52 @@
+import hashlib
+from collections import defaultdict
+
+
+class SeenEntities:
+    # Set of "blueprint;identifier" keys, stored as 64 bit identifier hashes per blueprint to keep memory flat.
+    # A hash collision can only keep a stale entity, never delete an entity that was seen.
+    def __init__(self, entity_keys=()):
+        self._identifiers_hashes = defaultdict(set)
+        self.update(entity_keys)
+
+    @staticmethod
+    def _hash_identifier(identifier):
+        return int.from_bytes(hashlib.blake2b(str(identifier).encode(), digest_size=8).digest(), "big")
+
+    def add(self, blueprint, identifier):
+        self._identifiers_hashes[blueprint].add(self._hash_identifier(identifier))
+
+    def update(self, entity_keys):
+        for entity_key in entity_keys:
+            blueprint, _, identifier = entity_key.partition(";")
+            self.add(blueprint, identifier)
+
+    def contains(self, blueprint, identifier):
+        return self._hash_identifier(identifier) in self._identifiers_hashes.get(blueprint, ())
+
+    def __len__(self):
+        return sum(len(identifiers_hashes) for identifiers_hashes in self._identifiers_hashes.values())
+
+    def dump_chunks(self, chunk_size):
+        chunk, chunk_length = {}, 0
+        for blueprint, identifiers_hashes in self._identifiers_hashes.items():
+            identifiers_hashes = list(identifiers_hashes)
+            while identifiers_hashes:
+                taken = identifiers_hashes[:chunk_size - chunk_length]
+                identifiers_hashes = identifiers_hashes[len(taken):]
+                chunk[blueprint] = taken
+                chunk_length += len(taken)
+                if chunk_length >= chunk_size:
+                    yield chunk
+                    chunk, chunk_length = {}, 0
+
+        if chunk:
+            yield chunk
+
+    def load_chunk(self, chunk):
+        if isinstance(chunk, list):  # Chunks of "blueprint;identifier" keys, written by older versions
+            self.update(chunk)
+            return
+
+        for blueprint, identifiers_hashes in chunk.items():
+            self._identifiers_hashes[blueprint].update(identifiers_hashes)
@@ -0,0 +1,298 @@
+import io
+import json
+import threading
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+
+import botocore.awsrequest
+import botocore.session
+from botocore.response import StreamingBody
+
+ACCOUNT_ID = "123456789012"
+PAGE_SIZE = 100
+
+
+class FakeAWSError(Exception):
+    def __init__(self, status_code, code, message):
+        super().__init__(message)
+        self.status_code = status_code
+        self.code = code
+
+
+def _page(items, token, page_size=PAGE_SIZE):
+    start = int(token or 0)
+    next_token = str(start + page_size) if start + page_size < len(items) else None
+    return items[start:start + page_size], next_token
+
+
+class _RawResponse:
+    def __init__(self, body):
+        self._body = body
+
+    def stream(self, **kwargs):
+        return iter([self._body])
+
+    def read(self, amt=None):
+        body, self._body = self._body, b""
+        return body
+
+
+def _get_empty_body(model, status_code):
+    # Smallest body botocore's parser of the protocol accepts, the parsed response is added to what it parses
+    protocol = model.service_model.resolved_protocol
+    if protocol in ("json", "rest-json", "smithy-rpc-v2-cbor"):
+        return b"{}" if status_code < 300 else b'{"__type": "FakeAWSError"}'
+    if status_code >= 300:
+        return b"<Error><Code>FakeAWSError</Code></Error>" if protocol == "rest-xml" else \
+            b"<Response><Errors><Error><Code>FakeAWSError</Code></Error></Errors></Response>" if protocol == "ec2" else \
+            b"<ErrorResponse><Error><Code>FakeAWSError</Code></Error></ErrorResponse>"
+    if protocol == "query":
+        return f"<{model.name}Response><{model.name}Result/></{model.name}Response>".encode()
+    return f"<{model.name}Response/>".encode() if protocol == "ec2" else b""
+
+
+class FakeAWS:
+    # Answers botocore calls in memory, in place of sending their HTTP requests. Every attempt goes through botocore as
+    # a real request would, so the rate limiter and the retries of the exporter are exercised too
+    def __init__(self, counts, throttle_every=0):
+        self.counts = counts
+        self.throttle_every = throttle_every  # Every Nth request is throttled, 0 to never throttle
+        self.calls = Counter()
+        self.throttles = 0
+        self.s3 = {}
+        self.s3_last_modified = {}
+        self.invocations = []
+        self._requests_count = 0
+        self._responses = {}  # Response id -> parsed response, from the request sending to its parsing
+        self._lock = threading.Lock()
+
+    def install(self):
+        create_client = self._create_client = botocore.session.Session.create_client
+        fake_aws = self
+
+        def create_fake_client(session, *args, **kwargs):
+            client = create_client(session, *args, **kwargs)
+            client.meta.events.register_first("before-parameter-build.*.*", fake_aws._capture_params)
+            # Registered last, so the before-send hooks of the exporter (the rate limiter) run before the request is
+            # answered. The parsed response is then added to the one botocore parses from the empty HTTP response
+            client.meta.events.register_last("before-send.*.*", fake_aws._send)
+            client.meta.events.register_first("before-parse.*.*", fake_aws._parse)
+            return client
+
+        botocore.session.Session.create_client = create_fake_client
+
+    def uninstall(self):
+        botocore.session.Session.create_client = self._create_client
+
+    def expected_entities(self):
+        expected = set()
+        expected.update(("ec2Instance", f"i-{k:08d}") for k in range(self.counts["ec2"]))
+        expected.update(("acmCertificate", self._certificate_arn(k)) for k in range(self.counts["acm"]))
+        expected.update(("cloudformationStack", stack["StackName"]) for stack in self._stacks()
+                        if stack["StackStatus"] != "DELETE_COMPLETE")
+        expected.update(("loadBalancer", f"lb-{k}") for k in range(self.counts["elbv2"]))
+        expected.update(("elasticacheCluster", f"cluster-{k}") for k in range(self.counts["elasticache"]))
+        expected.update(("s3Bucket", f"bucket-{k}") for k in range(self.counts["cloudcontrol"]))
+        return expected
+
+    def _capture_params(self, params, model, context, **kwargs):
+        context["fake_aws_params"] = dict(params)
+        context["fake_aws_model"] = model
+
+    def _send(self, request, **kwargs):
+        model = request.context["fake_aws_model"]
+        service_name, operation_name = model.service_model.service_name, model.name
+        with self._lock:
+            self.calls[f"{service_name}.{operation_name}"] += 1
+            self._requests_count += 1
+            throttled = self.throttle_every and self._requests_count % self.throttle_every == 0
+            if throttled:
+                self.throttles += 1
+        operation = getattr(self, f"_{service_name}_{operation_name}", None)
+        if operation is None:
+            raise NotImplementedError(f"Fake AWS doesn't implement {service_name}.{operation_name}")
+
+        status_code = 200
+        try:
+            if throttled:
+                raise FakeAWSError(400, "Throttling", "Rate exceeded")
+            response = operation(request.context["fake_aws_params"])
+        except FakeAWSError as e:
+            # Raised by botocore as the modeled exception (e.g. NoSuchKey), or retried if it's throttling
+            status_code = e.status_code
+            response = {"Error": {"Code": e.code, "Message": str(e)}}
+        response_id = uuid.uuid4().hex
+        self._responses[response_id] = response
+        return botocore.awsrequest.AWSResponse("https://fake-aws", status_code,
+                                               {"x-fake-aws-response-id": response_id},
+                                               _RawResponse(_get_empty_body(model, status_code)))
+
+    def _parse(self, response_dict, customized_response_dict, **kwargs):
+        response_id = response_dict["headers"].get("x-fake-aws-response-id")
+        if response_id:
+            customized_response_dict.update(self._responses.pop(response_id))
+
+    # EC2
+    def _ec2_DescribeInstances(self, params):
+        instances = [{"InstanceId": f"i-{k:08d}", "InstanceType": "t3.micro", "State": {"Name": "running"},
+                      "LaunchTime": datetime(2024, 1, 1), "Tags": [{"Key": "Name", "Value": f"instance-{k}"}]}
+                     for k in range(self.counts["ec2"])]
+        if params.get("InstanceIds"):
+            if "MaxResults" in params:
+                raise FakeAWSError(400, "InvalidParameterCombination",
+                                   "The parameter instancesSet cannot be used with the parameter maxResults")
+            return {"Reservations": [{"Instances": [instance for instance in instances
+                                                    if instance["InstanceId"] in params["InstanceIds"]]}]}
+        page, next_token = _page(instances, params.get("NextToken"), params.get("MaxResults", 1000))
+        response = {"Reservations": [{"Instances": page[i:i + 2]} for i in range(0, len(page), 2)]}
+        if next_token:
+            response["NextToken"] = next_token
+        return response
+
+    # ACM
+    @staticmethod
+    def _certificate_arn(k):
+        return f"arn:aws:acm:us-east-1:{ACCOUNT_ID}:certificate/00000000-0000-0000-0000-{k:012d}"
+
+    def _acm_ListCertificates(self, params):
+        certificates = [{"CertificateArn": self._certificate_arn(k)} for k in range(self.counts["acm"])]
+        page, next_token = _page(certificates, params.get("NextToken"))
+        response = {"CertificateSummaryList": page}
+        if next_token:
+            response["NextToken"] = next_token
+        return response
+
+    def _acm_DescribeCertificate(self, params):
+        return {"Certificate": {"CertificateArn": params["CertificateArn"], "DomainName": "example.com",
+                                "Status": "ISSUED", "CreatedAt": datetime(2024, 1, 1)}}
+
+    # CloudFormation
+    def _stacks(self):
+        # Every fifth stack is deleted, and shouldn't reach Port
+        return [{"StackId": f"arn:aws:cloudformation:us-east-1:{ACCOUNT_ID}:stack/stack-{k}/{k}",
+                 "StackName": f"stack-{k}", "StackStatus": "DELETE_COMPLETE" if k % 5 == 4 else "CREATE_COMPLETE",
+                 "CreationTime": datetime(2024, 1, 1)} for k in range(self.counts["cloudformation"])]
+
+    def _cloudformation_DescribeStacks(self, params):
+        stacks = self._stacks()
+        if params.get("StackName"):
+            return {"Stacks": [stack for stack in stacks if params["StackName"] in (stack["StackId"], stack["StackName"])]}
+        page, next_token = _page(stacks, params.get("NextToken"))
+        response = {"Stacks": page}
+        if next_token:
+            response["NextToken"] = next_token
+        return response
+
+    def _cloudformation_DescribeStackResources(self, params):
+        return {"StackResources": [{"LogicalResourceId": "Bucket", "ResourceType": "AWS::S3::Bucket",
+                                    "Timestamp": datetime(2024, 1, 1)}]}
+
+    def _cloudformation_GetTemplate(self, params):
+        return {"TemplateBody": "Resources:\n  Bucket:\n    Type: AWS::S3::Bucket\n"}
+
+    # ELBv2
+    def _elbv2_DescribeLoadBalancers(self, params):
+        load_balancers = [{"LoadBalancerName": f"lb-{k}", "Type": "application", "CreatedTime": datetime(2024, 1, 1),
+                           "LoadBalancerArn": f"arn:aws:elasticloadbalancing:us-east-1:{ACCOUNT_ID}:loadbalancer/app/lb-{k}/{k}"}
+                          for k in range(self.counts["elbv2"])]
+        if params.get("Names"):
+            return {"LoadBalancers": [lb for lb in load_balancers if lb["LoadBalancerName"] in params["Names"]]}
+        page, next_marker = _page(load_balancers, params.get("Marker"), params.get("PageSize", PAGE_SIZE))
+        response = {"LoadBalancers": page}
+        if next_marker:
+            response["NextMarker"] = next_marker
+        return response
+
+    def _elbv2_DescribeLoadBalancerAttributes(self, params):
+        return {"Attributes": [{"Key": "deletion_protection.enabled", "Value": "false"}]}
+
+    def _elbv2_DescribeListeners(self, params):
+        return {"Listeners": [{"Port": 443, "Protocol": "HTTPS"}]}
+
+    def _elbv2_DescribeTags(self, params):
+        return {"TagDescriptions": [{"ResourceArn": arn, "Tags": [{"Key": "team", "Value": "platform"}]}
+                                    for arn in params["ResourceArns"]]}
+
+    # ElastiCache
+    def _elasticache_DescribeCacheClusters(self, params):
+        clusters = [{"CacheClusterId": f"cluster-{k}", "Engine": "redis",
+                     "ARN": f"arn:aws:elasticache:us-east-1:{ACCOUNT_ID}:cluster:cluster-{k}"}
+                    for k in range(self.counts["elasticache"])]
+        if params.get("CacheClusterId"):
+            return {"CacheClusters": [cluster for cluster in clusters
+                                      if cluster["CacheClusterId"] == params["CacheClusterId"]]}
+        page, marker = _page(clusters, params.get("Marker"))
+        response = {"CacheClusters": page}
+        if marker:
+            response["Marker"] = marker
+        return response
+
+    def _elasticache_ListTagsForResource(self, params):
+        return {"TagList": [{"Key": "team", "Value": "platform"}]}
+
+    # CloudControl
+    @staticmethod
+    def _bucket_properties(bucket_name, listed=False):
+        # Like CloudControl, listed resources hold only some of the properties returned by GetResource
+        properties = {"BucketName": bucket_name, "Arn": f"arn:aws:s3:::{bucket_name}"}
+        if not listed:
+            properties["Tags"] = [{"Key": "team", "Value": "platform"}]
+        return json.dumps(properties)
+
+    def _cloudcontrol_ListResources(self, params):
+        resources = [{"Identifier": f"bucket-{k}", "Properties": self._bucket_properties(f"bucket-{k}", listed=True)}
+                     for k in range(self.counts["cloudcontrol"])]
+        page, next_token = _page(resources, params.get("NextToken"))
+        response = {"TypeName": params["TypeName"], "ResourceDescriptions": page}
+        if next_token:
+            response["NextToken"] = next_token
+        return response
+
+    def _cloudcontrol_GetResource(self, params):
+        return {"TypeName": params["TypeName"],
+                "ResourceDescription": {"Identifier": params["Identifier"],
+                                        "Properties": self._bucket_properties(params["Identifier"])}}
+
+    # S3, Secrets Manager and Lambda, for the config, checkpoints and re-invocations
+    def _s3_GetObject(self, params):
+        if params["Key"] not in self.s3:
+            raise FakeAWSError(404, "NoSuchKey", "The specified key does not exist.")
+        body = self.s3[params["Key"]]
+        etag = f'"{hash(body)}"'
+        if params.get("IfNoneMatch") == etag:
+            raise FakeAWSError(304, "304", "Not Modified")
+        return {"Body": StreamingBody(io.BytesIO(body), len(body)), "ETag": etag}
+
+    def _s3_PutObject(self, params):
+        body = params["Body"]
+        self.s3_last_modified[params["Key"]] = datetime.now(timezone.utc)
+        self.s3[params["Key"]] = body.encode() if isinstance(body, str) else body if isinstance(body, bytes) else body.read()
+        return {}
+
+    def _s3_ListObjectsV2(self, params):
+        keys = sorted(key for key in list(self.s3) if key.startswith(params.get("Prefix", "")))
+        keys, next_token = _page(keys, params.get("ContinuationToken"), params.get("MaxKeys", 1000))
+        # Objects put directly in the fake, like the config file, are dated like the other fake resources
+        contents = [{"Key": key, "LastModified": self.s3_last_modified.get(key, datetime(2024, 1, 1, tzinfo=timezone.utc)),
+                     "Size": len(self.s3.get(key, b""))} for key in keys]
+        response = {"Contents": contents, "KeyCount": len(contents), "IsTruncated": bool(next_token)}
+        if next_token:
+            response["NextContinuationToken"] = next_token
+        return response
+
+    def _s3_DeleteObject(self, params):
+        self.s3.pop(params["Key"], None)
+        return {}
+
+    def _s3_DeleteObjects(self, params):
+        for deleted_object in params["Delete"]["Objects"]:
+            self.s3.pop(deleted_object["Key"], None)
+        return {}
+
+    def _secretsmanager_GetSecretValue(self, params):
+        return {"SecretString": json.dumps({"id": "client-id", "clientSecret": "client-secret"})}
+
+    def _lambda_Invoke(self, params):
+        self.invocations.append(json.loads(params["Payload"]))
+        return {"StatusCode": 202}
@@ -0,0 +1,111 @@
+import json
+import threading
+import time
+import urllib.parse
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakePort:
+    # Local HTTP server with the Port API endpoints used by the exporter, with added latency and injected 429s
+    def __init__(self, latency_ms=0, fail_429_every=0):
+        self.latency_ms = latency_ms
+        self.fail_429_every = fail_429_every
+        self.entities = {}  # (blueprint, identifier) -> entity
+        self.deleted_blueprints = set()  # Blueprints answered with 404, as if they were deleted from Port
+        self.calls = Counter()
+        self._requests_count = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._create_request_handler())
+        self._server.daemon_threads = True
+        self.api_url = f"http://127.0.0.1:{self._server.server_address[1]}/v1"
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self._server.shutdown()
+
+    def _create_request_handler(self):
+        fake_port = self
+
+        class RequestHandler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                fake_port._route(self, "POST")
+
+            def do_DELETE(self):
+                fake_port._route(self, "DELETE")
+
+            def send_json(self, status, body, headers=None):
+                encoded_body = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(encoded_body)))
+                for header, value in (headers or {}).items():
+                    self.send_header(header, value)
+                self.end_headers()
+                self.wfile.write(encoded_body)
+
+        return RequestHandler
+
+    def _route(self, request, method):
+        url = urllib.parse.urlparse(request.path)
+        path = [urllib.parse.unquote(part) for part in url.path.split("/")[2:]]
+        content_length = int(request.headers.get("Content-Length") or 0)
+        body = json.loads(request.rfile.read(content_length) or b"null")
+        time.sleep(self.latency_ms / 1000)
+
+        with self._lock:
+            self._requests_count += 1
+            if self.fail_429_every and path[0] != "auth" and self._requests_count % self.fail_429_every == 0:
+                self.calls["429"] += 1
+                return request.send_json(429, {"ok": False}, {"Retry-After": "0"})
+
+        if path == ["auth", "access_token"]:
+            self.calls["access_token"] += 1
+            return request.send_json(200, {"accessToken": "token", "expiresIn": 10800, "tokenType": "Bearer"})
+        if path == ["integration"]:
+            self.calls["integration"] += 1
+            return request.send_json(200, {"ok": True})
+        if path == ["entities", "search"]:
+            self.calls["search"] += 1
+            return request.send_json(200, {"ok": True, "entities": [{"blueprint": blueprint, "identifier": identifier}
+                                                                    for blueprint, identifier in list(self.entities)]})
+        if path[0] != "blueprints" or len(path) < 3:
+            return request.send_json(404, {"ok": False})
+
+        blueprint = path[1]
+        if blueprint in self.deleted_blueprints:
+            return request.send_json(404, {"ok": False, "error": "not_found"})
+        if method == "POST" and path[2:] == ["entities", "search"]:
+            self.calls["blueprint_search"] += 1
+            identifiers = sorted(identifier for entity_blueprint, identifier in list(self.entities)
+                                 if entity_blueprint == blueprint)
+            # Like Port, the next page is a cursor after the last entity returned, so deleting entities between
+            # pages doesn't skip any
+            limit = int(body.get("limit") or 1000)
+            page = [identifier for identifier in identifiers if not body.get("from") or identifier > body["from"]][:limit]
+            next_page = page[-1] if page and page[-1] != identifiers[-1] else None
+            return request.send_json(200, {"ok": True, "next": next_page,
+                                           "entities": [{"blueprint": blueprint, "identifier": identifier}
+                                                        for identifier in page]})
+        if method == "POST" and path[2:] == ["entities"]:
+            self.calls["upsert"] += 1
+            self.entities[(blueprint, body["identifier"])] = body
+            return request.send_json(201, {"ok": True})
+        if method == "POST" and path[2:] == ["entities", "bulk"]:
+            self.calls["bulk_upsert"] += 1
+            for entity in body["entities"]:
+                self.entities[(blueprint, entity["identifier"])] = entity
+            return request.send_json(200, {"ok": True, "entities": [], "errors": []})
+        if method == "DELETE" and path[2:] == ["bulk", "entities"]:
+            self.calls["bulk_delete"] += 1
+            for identifier in body["entities"]:
+                self.entities.pop((blueprint, identifier), None)
+            return request.send_json(200, {"ok": True, "errors": []})
+        if method == "DELETE" and path[2] == "entities" and len(path) == 4:
+            self.calls["delete"] += 1
+            self.entities.pop((blueprint, path[3]), None)
+            return request.send_json(200, {"ok": True})
+        return request.send_json(404, {"ok": False})
@@ -0,0 +1,204 @@
+"""Offline end to end benchmark of the exporter, against in-memory AWS services and a local fake Port server.
+
+Runs full syncs through app.lambda_handler, following re-invocations, and reports entities/sec, API calls per entity,
+peak memory (traced Python allocations) and re-invocations. Results can be saved as JSON and compared with a baseline,
+failing the run on a regression.
+
+AWS requests are answered in place of their HTTP requests, so they go through botocore's retries and the adaptive rate
+limiter of the exporter as real ones would. Timings include the limiter pacing, and --aws-throttle-every exercises it.
+
+Usage: python scripts/benchmark/run_benchmark.py [--resources 200] [--latency-ms 20] [--fail-429-every 50]
+                                                 [--aws-throttle-every 50] [--fan-out 4] [--warm-runs 1] [--output results.json]
+                                                 [--baseline baseline.json]
+
+Invocations, re-invocations and the shards of a fanned out sync alike, are run one after the other.
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import sys
+import time
+import tracemalloc
+import uuid
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+LAMBDA_FUNCTION_DIR = os.path.join(os.path.dirname(os.path.dirname(BENCHMARK_DIR)), "lambda_function")
+
+os.environ.update(AWS_ACCESS_KEY_ID="benchmark", AWS_SECRET_ACCESS_KEY="benchmark", AWS_DEFAULT_REGION="us-east-1",
+                  BUCKET_NAME="port-aws-exporter-benchmark", CONFIG_JSON_FILE_KEY="config/config.json",
+                  PORT_CREDS_SECRET_ARN="arn:aws:secretsmanager:us-east-1:123456789012:secret:port-credentials")
+
+from fake_aws import FakeAWS  # noqa: E402
+from fake_port import FakePort  # noqa: E402
+
+KINDS = ["ec2", "acm", "cloudformation", "elbv2", "elasticache", "cloudcontrol"]
+STALE_BLUEPRINT = "ec2Instance"
+CONFIG = {
+    "resources": [
+        {"kind": "AWS::EC2::Instance", "selector": {"query": "true"},
+         "port": {"entity": {"mappings": [{"identifier": ".InstanceId", "title": ".Tags[0].Value",
+                                           "blueprint": '"ec2Instance"',
+                                           "properties": {"type": ".InstanceType", "state": ".State.Name"}}]}}},
+        {"kind": "AWS::ACM::Certificate", "selector": {"query": "true"},
+         "port": {"entity": {"mappings": [{"identifier": ".CertificateArn", "title": ".DomainName",
+                                           "blueprint": '"acmCertificate"', "properties": {"status": ".Status"}}]}}},
+        {"kind": "AWS::CloudFormation::Stack", "selector": {"query": "true"},
+         "port": {"entity": {"mappings": [{"identifier": ".StackName", "blueprint": '"cloudformationStack"',
+                                           "properties": {"status": ".StackStatus", "template": ".TemplateBody",
+                                                          "resources": ".StackResources | length"}}]}}},
+        {"kind": "AWS::ElasticLoadBalancingV2::LoadBalancer", "selector": {"query": "true"},
+         "port": {"entity": {"mappings": [{"identifier": ".LoadBalancerName", "blueprint": '"loadBalancer"',
+                                           "properties": {"type": ".Type", "tags": ".Tags",
+                                                          "listeners": ".Listeners", "attributes": ".Attributes"}}]}}},
+        {"kind": "AWS::ElastiCache::CacheCluster", "selector": {"query": "true"},
+         "port": {"entity": {"mappings": [{"identifier": ".CacheClusterId", "blueprint": '"elasticacheCluster"',
+                                           "properties": {"engine": ".Engine", "tags": ".Tags"}}]}}},
+        {"kind": "AWS::S3::Bucket", "selector": {"query": "true"},
+         "port": {"entity": {"mappings": [{"identifier": ".BucketName", "blueprint": '"s3Bucket"',
+                                           "properties": {"arn": ".Arn"}}]}}},
+    ]
+}
+# Metrics compared with the baseline, and whether higher values are better
+COMPARED_METRICS = {"entities_per_second": True, "aws_calls_per_entity": False, "port_calls_per_entity": False,
+                    "peak_memory_mb": False, "reinvocations": False}
+
+
+class LambdaContext:
+    def __init__(self, timeout_ms):
+        self._deadline = time.monotonic() + timeout_ms / 1000
+        self.invoked_function_arn = "arn:aws:lambda:us-east-1:123456789012:function:port-aws-exporter"
+        self.function_name = "port-aws-exporter"
+        self.aws_request_id = str(uuid.uuid4())
+
+    def get_remaining_time_in_millis(self):
+        return int((self._deadline - time.monotonic()) * 1000)
+
+
+def run_sync(app, fake_aws, fake_port, timeout_ms):
+    fake_aws.calls.clear()
+    fake_aws.throttles = 0
+    fake_port.calls.clear()
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+
+    reinvocations = 0
+    # The metrics printed by the exporter, as CloudWatch embedded metric format lines, are left out of the report
+    with contextlib.redirect_stdout(io.StringIO()):
+        app.lambda_handler({}, LambdaContext(timeout_ms))
+        while fake_aws.invocations:
+            reinvocations += 1
+            app.lambda_handler(fake_aws.invocations.pop(0), LambdaContext(timeout_ms))
+
+    seconds = time.perf_counter() - start
+    entities = len(fake_aws.expected_entities())
+    return {
+        "entities": entities,
+        "seconds": round(seconds, 3),
+        "entities_per_second": round(entities / seconds, 1),
+        "aws_calls_per_entity": round(sum(fake_aws.calls.values()) / entities, 3),
+        "port_calls_per_entity": round(sum(fake_port.calls.values()) / entities, 3),
+        "peak_memory_mb": round(tracemalloc.get_traced_memory()[1] / 1024 / 1024, 1),
+        "reinvocations": reinvocations,
+        "aws_throttles": fake_aws.throttles,
+        "aws_calls": dict(fake_aws.calls),
+        "port_calls": dict(fake_port.calls),
+    }
+
+
+def get_regressions(results, baseline, tolerance):
+    regressions = []
+    if results["scenario"] != baseline.get("scenario"):
+        logging.warning("The baseline was measured with a different scenario, comparing anyway")
+
+    for run_index, (run, baseline_run) in enumerate(zip(results["runs"], baseline.get("runs", []))):
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            value, baseline_value = run[metric], baseline_run.get(metric)
+            if baseline_value is None:
+                continue
+            if metric == "reinvocations":
+                regressed = value > baseline_value
+            elif higher_is_better:
+                regressed = value < baseline_value * (1 - tolerance)
+            else:
+                regressed = value > baseline_value * (1 + tolerance)
+            if regressed:
+                regressions.append(f"run {run_index}, {metric}: {value} (baseline: {baseline_value})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end to end benchmark of the exporter")
+    parser.add_argument("--resources", type=int, default=200, help="Resources of every kind")
+    for kind in KINDS:
+        parser.add_argument(f"--{kind}", type=int, help=f"Resources of {kind}, instead of --resources")
+    parser.add_argument("--stale", type=int, default=50, help=f"Stale {STALE_BLUEPRINT} entities to delete")
+    parser.add_argument("--latency-ms", type=float, default=0, help="Latency of every Port request")
+    parser.add_argument("--fail-429-every", type=int, default=0, help="Answer every Nth Port request with 429")
+    parser.add_argument("--aws-throttle-every", type=int, default=0,
+                        help="Throttle every Nth AWS request, retried by botocore and slowing down the rate limiter")
+    parser.add_argument("--timeout-ms", type=int, default=15 * 60 * 1000,
+                        help="Lambda timeout, lower it to force re-invocations")
+    parser.add_argument("--fan-out", type=int, default=0,
+                        help="Sync in a fanned out sync, with up to this many shards in parallel")
+    parser.add_argument("--warm-runs", type=int, default=0, help="Full syncs to run again with the same resources")
+    parser.add_argument("--output", help="Save the results to this JSON file")
+    parser.add_argument("--baseline", help="Compare with the results saved in this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression from the baseline")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+
+    counts = {kind: getattr(args, kind) if getattr(args, kind) is not None else args.resources for kind in KINDS}
+    fake_aws = FakeAWS(counts, throttle_every=args.aws_throttle_every)
+    fake_aws.install()
+    fake_port = FakePort(latency_ms=args.latency_ms, fail_429_every=args.fail_429_every)
+    config = {**CONFIG, "port_api_url": fake_port.api_url}
+    if args.fan_out:
+        config["fan_out"] = {"enabled": True, "max_parallel_shards": args.fan_out}
+    fake_aws.s3[os.environ["CONFIG_JSON_FILE_KEY"]] = json.dumps(config).encode()
+    fake_port.entities.update({(STALE_BLUEPRINT, f"stale-{k}"): {} for k in range(args.stale)})
+
+    sys.path.insert(0, LAMBDA_FUNCTION_DIR)
+    import app
+    logging.getLogger().setLevel(args.log_level)
+
+    tracemalloc.start()
+    results = {"scenario": {"counts": counts, "stale": args.stale, "latency_ms": args.latency_ms,
+                            "fail_429_every": args.fail_429_every, "aws_throttle_every": args.aws_throttle_every,
+                            "timeout_ms": args.timeout_ms,
+                            "fan_out": args.fan_out}, "runs": []}
+    failed = False
+    for run_index in range(1 + args.warm_runs):
+        run = run_sync(app, fake_aws, fake_port, args.timeout_ms)
+        results["runs"].append(run)
+        print(f"run {run_index}: {run['entities']} entities in {run['seconds']}s, "
+              f"{run['entities_per_second']} entities/sec, {run['aws_calls_per_entity']} AWS calls/entity, "
+              f"{run['port_calls_per_entity']} Port calls/entity, peak memory {run['peak_memory_mb']}MB, "
+              f"{run['reinvocations']} re-invocations, {run['aws_throttles']} AWS throttles")
+
+        expected_entities = fake_aws.expected_entities()
+        missing, unexpected = expected_entities - set(fake_port.entities), set(fake_port.entities) - expected_entities
+        if missing or unexpected:
+            failed = True
+            print(f"run {run_index}: Port doesn't match AWS, missing: {sorted(missing)[:5]} ({len(missing)}),"
+                  f" unexpected: {sorted(unexpected)[:5]} ({len(unexpected)})")
+
+    fake_port.close()
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = get_regressions(results, json.load(baseline_file), args.tolerance)
+        for regression in regressions:
+            print(f"Regression, {regression}")
+        failed = failed or bool(regressions)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""Report the import time of the Lambda modules, as measured by `python -X importtime` in fresh interpreters.
+
+Usage: python scripts/cold_start_benchmark.py [--runs 5] [--top 25] [--module app] [--max-total-ms 300]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+
+LAMBDA_FUNCTION_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "lambda_function")
+
+
+def measure_import_times(module):
+    env = {**os.environ, "AWS_DEFAULT_REGION": os.environ.get("AWS_DEFAULT_REGION", "us-east-1")}
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=LAMBDA_FUNCTION_DIR,
+                            env=env, capture_output=True, text=True, check=True)
+    import_times = {}  # Module -> (self us, cumulative us)
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, cumulative_us, imported_module = line[len("import time:"):].split("|")
+        if not self_us.strip().isdigit():  # Header line
+            continue
+        import_times[imported_module.strip()] = (int(self_us), int(cumulative_us))
+    return import_times
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lambda cold start import time benchmark")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=25)
+    parser.add_argument("--module", default="app", help="Module imported by the Lambda runtime")
+    parser.add_argument("--max-total-ms", type=float, help="Exit with an error if the import takes longer")
+    args = parser.parse_args()
+
+    self_times = defaultdict(list)
+    cumulative_times = defaultdict(list)
+    for _ in range(args.runs):
+        for imported_module, (self_us, cumulative_us) in measure_import_times(args.module).items():
+            self_times[imported_module].append(self_us)
+            cumulative_times[imported_module].append(cumulative_us)
+
+    medians = {imported_module: (statistics.median(self_times[imported_module]) / 1000,
+                                 statistics.median(cumulative_times[imported_module]) / 1000)
+               for imported_module in cumulative_times}
+    print(f"{'cumulative ms':>14} {'self ms':>9}  module (median of {args.runs} runs)")
+    for imported_module, (self_ms, cumulative_ms) in sorted(medians.items(), key=lambda item: -item[1][1])[:args.top]:
+        print(f"{cumulative_ms:>14.1f} {self_ms:>9.1f}  {imported_module}")
+
+    total_ms = medians.get(args.module, (0, 0))[1]
+    print(f"\nimport {args.module}: {total_ms:.1f}ms")
+    if args.max_total_ms is not None and total_ms > args.max_total_ms:
+        print(f"Import time regression, {total_ms:.1f}ms is over the {args.max_total_ms:.1f}ms limit")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import json
+import os
+import sys
+import time
+import uuid
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# The Lambda code imports its modules from the root of its package, as the Lambda runtime does
+sys.path.insert(0, os.path.join(ROOT_DIR, "lambda_function"))
+# In-memory AWS services and local Port server of the benchmark, to run the exporter end to end
+sys.path.insert(0, os.path.join(ROOT_DIR, "scripts", "benchmark"))
+
+CONFIG_FILE_KEY = "config/config.json"
+RESOURCES_PER_INVOCATION = 2  # Resources of every kind an invocation has time for, with the short_invocations fixture
+CONFIG = {
+    "resources": [
+        {"kind": "AWS::EC2::Instance", "selector": {"query": "true"},
+         "port": {"entity": {"mappings": [{"identifier": ".InstanceId", "blueprint": '"ec2Instance"',
+                                           "properties": {"state": ".State.Name"}}]}}},
+        {"kind": "AWS::ACM::Certificate", "selector": {"query": "true"},
+         "port": {"entity": {"mappings": [{"identifier": ".CertificateArn", "blueprint": '"acmCertificate"',
+                                           "properties": {"status": ".Status"}}]}}},
+    ],
+}
+
+
+class LambdaContext:
+    def __init__(self, timeout_ms=15 * 60 * 1000):
+        self._deadline = time.monotonic() + timeout_ms / 1000
+        self.invoked_function_arn = "arn:aws:lambda:us-east-1:123456789012:function:port-aws-exporter"
+        self.function_name = "port-aws-exporter"
+        self.aws_request_id = str(uuid.uuid4())
+
+    def get_remaining_time_in_millis(self):
+        return int((self._deadline - time.monotonic()) * 1000)
+
+
+class Exporter:
+    # Runs the exporter Lambda handler against the fakes, following the invocations it makes
+    def __init__(self, fake_aws, fake_port):
+        self.fake_aws = fake_aws
+        self.fake_port = fake_port
+        self.set_config(CONFIG)
+
+    def set_config(self, config):
+        self.config = json.loads(json.dumps(config))
+        self.fake_aws.s3[CONFIG_FILE_KEY] = json.dumps({**self.config, "port_api_url": self.fake_port.api_url}).encode()
+
+    def invoke(self, event=None, timeout_ms=15 * 60 * 1000):
+        import app
+        return app.lambda_handler(event or {}, LambdaContext(timeout_ms))
+
+    def sync(self, timeout_ms=15 * 60 * 1000):
+        # A scheduled invocation, and the invocations it leads to. Returns how many invocations followed it
+        self.invoke(timeout_ms=timeout_ms)
+        invocations = 0
+        while self.fake_aws.invocations:
+            invocations += 1
+            self.invoke(self.fake_aws.invocations.pop(0), timeout_ms)
+        return invocations
+
+
+@pytest.fixture
+def fake_aws(monkeypatch):
+    from aws import clients
+    from fake_aws import FakeAWS
+
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "test")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "test")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    monkeypatch.setenv("BUCKET_NAME", "port-aws-exporter-test")
+    monkeypatch.setenv("CONFIG_JSON_FILE_KEY", CONFIG_FILE_KEY)
+    monkeypatch.setenv("PORT_CREDS_SECRET_ARN", "arn:aws:secretsmanager:us-east-1:123456789012:secret:port")
+    # Clients are cached with the hooks of the fake they were created with
+    monkeypatch.setattr(clients, "_session", None)
+    monkeypatch.setattr(clients, "_clients", {})
+    aws = FakeAWS({"ec2": 5, "acm": 3, "cloudformation": 0, "elbv2": 0, "elasticache": 0, "cloudcontrol": 0})
+    aws.install()
+    yield aws
+    aws.uninstall()
+
+
+@pytest.fixture
+def fake_port():
+    from fake_port import FakePort
+
+    port = FakePort()
+    yield port
+    port.close()
+
+
+@pytest.fixture
+def exporter(fake_aws, fake_port):
+    return Exporter(fake_aws, fake_port)
+
+
+@pytest.fixture
+def short_invocations(monkeypatch):
+    # Invocations only have time for a few resources of every kind, so syncs are checkpointed and re-invoked
+    from aws.resources import base_handler
+
+    class ShortTimeBudget(base_handler.TimeBudget):
+        def __init__(self, lambda_context):
+            super().__init__(lambda_context)
+            self.items_left = RESOURCES_PER_INVOCATION
+
+        def get_affordable_items(self):
+            return 2 * self.items_left  # Chunks take half of the affordable resources
+
+        def record_items(self, count, elapsed_ms):
+            super().record_items(count, elapsed_ms)
+            self.items_left -= count
+
+    monkeypatch.setattr(base_handler, "TimeBudget", ShortTimeBudget)
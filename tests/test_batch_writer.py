@@ -0,0 +1,76 @@
+import pytest
+import requests
+
+from port.batch_writer import EntitiesBatchWriter
+
+
+def create_http_error(status_code):
+    response = requests.Response()
+    response.status_code = status_code
+    return requests.HTTPError(f"{status_code} Error", response=response)
+
+
+class PortClient:
+    def __init__(self, failing_ids=(), bulk_status_code=None):
+        self.failing_ids = set(failing_ids)
+        self.bulk_status_code = bulk_status_code
+        self.upserted = []
+        self.single_upserted = []
+
+    def upsert_entities(self, blueprint_id, entities):
+        if self.bulk_status_code:
+            raise create_http_error(self.bulk_status_code)
+        self.upserted.extend((blueprint_id, entity["identifier"]) for entity in entities)
+        # Bulk errors may only hold the index of the entity in the request
+        return [{"index": index, "message": "invalid entity"} for index, entity in enumerate(entities)
+                if entity["identifier"] in self.failing_ids]
+
+    def upsert_entity(self, entity):
+        if entity["identifier"] in self.failing_ids:
+            raise create_http_error(422)
+        self.single_upserted.append((entity["blueprint"], entity["identifier"]))
+
+
+def write(port_client, entities):
+    writer = EntitiesBatchWriter(port_client)
+    writer.write(entities)
+    writer.close()
+    return writer
+
+
+def test_failed_entities_of_bulk_requests():
+    port_client = PortClient(failing_ids={"i-2"})
+    writer = write(port_client, [{"blueprint": "ec2Instance", "identifier": f"i-{k}"} for k in range(3)])
+
+    assert port_client.upserted == [("ec2Instance", "i-0"), ("ec2Instance", "i-1"), ("ec2Instance", "i-2")]
+    assert writer.failed_entities == {"ec2Instance;i-2"}
+
+
+@pytest.mark.parametrize("status_code", [400, 404, 405, 422])
+def test_rejected_bulk_requests_fall_back_to_single_entity_requests(status_code):
+    port_client = PortClient(failing_ids={"i-2"}, bulk_status_code=status_code)
+    writer = write(port_client, [{"blueprint": "ec2Instance", "identifier": f"i-{k}"} for k in range(3)])
+
+    assert port_client.single_upserted == [("ec2Instance", "i-0"), ("ec2Instance", "i-1")]
+    assert writer.failed_entities == {"ec2Instance;i-2"}
+
+
+@pytest.mark.parametrize("status_code", [429, 500, 503])
+def test_throttled_or_failing_bulk_requests_are_not_retried_entity_by_entity(status_code):
+    port_client = PortClient(bulk_status_code=status_code)
+    writer = write(port_client, [{"blueprint": "ec2Instance", "identifier": f"i-{k}"} for k in range(3)])
+
+    assert port_client.single_upserted == []
+    assert writer.failed_entities == {"ec2Instance;i-0", "ec2Instance;i-1", "ec2Instance;i-2"}
+
+
+def test_entities_relating_to_failed_entities_are_still_upserted():
+    port_client = PortClient(failing_ids={"vpc-1"})
+    writer = EntitiesBatchWriter(port_client)
+    writer.write([{"blueprint": "vpc", "identifier": "vpc-1"},
+                  {"blueprint": "subnet", "identifier": "subnet-1", "relations": {"vpc": "vpc-1"}}])
+    writer.write([{"blueprint": "ec2Instance", "identifier": "i-1", "relations": {"subnets": ["subnet-1"]}}])
+    writer.close()
+
+    assert port_client.upserted == [("vpc", "vpc-1"), ("subnet", "subnet-1"), ("ec2Instance", "i-1")]
+    assert writer.failed_entities == {"vpc;vpc-1"}
@@ -0,0 +1,67 @@
+import json
+
+import pytest
+
+from aws.resources.cloudcontrol_handler import CloudControlHandler
+from port.entities import get_jq_queries_top_level_keys
+
+LISTED_BUCKET = {"Identifier": "bucket-0", "Properties": json.dumps({"BucketName": "bucket-0", "Arn": "arn:bucket-0"})}
+
+
+def create_handler(mapping_properties, list_properties=None):
+    selector = {"query": "true"}
+    if list_properties:
+        selector["aws"] = {"list_properties": list_properties}
+    resource_config = {"kind": "AWS::S3::Bucket", "selector": selector,
+                       "port": {"entity": {"mappings": [{"identifier": ".BucketName", "blueprint": '"s3Bucket"',
+                                                         "properties": mapping_properties}]}}}
+    return CloudControlHandler(resource_config, None, None, "us-east-1")
+
+
+def get_listed_resource_obj(handler):
+    return handler._get_listed_resources({"ResourceDescriptions": [LISTED_BUCKET]}, "us-east-1")[0][1]
+
+
+@pytest.mark.parametrize("jq_query", ['.Arn', '{Arn}', '{arn: .Arn}', '.["Arn"]', '"\\(.Arn)"',
+                                      '.Arn | split(":") | .[0]', 'if .Arn then .BucketName else null end'])
+def test_listed_properties_are_used_when_they_hold_the_read_keys(jq_query):
+    assert get_listed_resource_obj(create_handler({"arn": jq_query})) == json.loads(LISTED_BUCKET["Properties"])
+
+
+@pytest.mark.parametrize("jq_query", ['.Tags', '{Arn, Tags}', '{arn: .Arn, tags: .Tags}', '.Arn + .Tags',
+                                      '.BucketName + tojson', '.Arn // to_entries', '.Arn == keys', 'length',
+                                      '.', '. + {}', '.[]', 'with_entries(.)', '{(.Arn): .Tags}', '"\\(.)"',
+                                      '.BucketName as $name | tostring', '.Arn | (', '"\\(.Arn'])
+def test_resource_is_fetched_when_listed_properties_may_not_hold_the_read_keys(jq_query):
+    assert get_listed_resource_obj(create_handler({"arn": jq_query})) is None
+
+
+def test_parsed_items_are_not_required_keys():
+    handler = create_handler({"arn": ".Arn"})
+    handler.mappings[0]["itemsToParse"] = ".Arn | [.]"
+    handler.mappings[0]["properties"]["item"] = ".item"
+    assert handler._get_required_keys() == {"BucketName", "Arn"}
+
+
+@pytest.mark.parametrize("list_properties, expected", [("always", True), ("never", False)])
+def test_list_properties_mode(list_properties, expected):
+    handler = create_handler({"tags": ".Tags"} if expected else {"arn": ".Arn"}, list_properties)
+    assert (get_listed_resource_obj(handler) is not None) == expected
+
+
+@pytest.mark.parametrize("jq_query, expected", [
+    ('{Arn, Tags}', {"Arn", "Tags"}),
+    ('{"Arn", $x, tags: .Tags}', {"Arn", "Tags"}),
+    ('.Tags | map({Key})', {"Tags"}),
+    ('.Arn + tojson', None),
+    ('.Arn - length', None),
+    ('.Arn * keys', None),
+    ('.Arn / tostring', None),
+    ('.Arn // to_entries', None),
+    ('.Arn == tojson', None),
+    ('.Arn and keys', None),
+    ('.Arn or to_entries', None),
+    ('.Tags | to_entries', {"Tags"}),
+])
+def test_top_level_keys(jq_query, expected):
+    assert get_jq_queries_top_level_keys([jq_query]) == expected
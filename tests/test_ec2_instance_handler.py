@@ -0,0 +1,24 @@
+import pytest
+
+from conftest import CONFIG
+
+
+def get_config(list_parameters):
+    ec2_resource_config, acm_resource_config = CONFIG["resources"]
+    ec2_resource_config = {**ec2_resource_config, "selector": {**ec2_resource_config["selector"],
+                                                              "aws": {"list_parameters": list_parameters}}}
+    return {**CONFIG, "resources": [ec2_resource_config, acm_resource_config]}
+
+
+@pytest.mark.parametrize("list_parameters, instance_ids", [
+    ({}, ["i-00000000", "i-00000001", "i-00000002", "i-00000003", "i-00000004"]),
+    ({"MaxResults": 5}, ["i-00000000", "i-00000001", "i-00000002", "i-00000003", "i-00000004"]),
+    # EC2 rejects MaxResults along with InstanceIds
+    ({"InstanceIds": ["i-00000001", "i-00000003"]}, ["i-00000001", "i-00000003"]),
+])
+def test_instances_are_listed_with_the_list_parameters(exporter, fake_port, list_parameters, instance_ids):
+    exporter.set_config(get_config(list_parameters))
+    exporter.sync()
+
+    assert sorted(identifier for blueprint, identifier in fake_port.entities if blueprint == "ec2Instance") == \
+           instance_ids
@@ -0,0 +1,44 @@
+import pytest
+
+from aws.resources.elasticache_cluster_handler import ElasticacheClusterHandler
+from port.entities import get_jq_queries_referenced_keys
+
+
+def create_handler(mapping_properties, selector_query="true"):
+    resource_config = {"kind": "AWS::ElastiCache::CacheCluster", "selector": {"query": selector_query},
+                       "port": {"entity": {"mappings": [{"identifier": ".CacheClusterId",
+                                                         "blueprint": '"elasticacheCluster"',
+                                                         "properties": mapping_properties}]}}}
+    return ElasticacheClusterHandler(resource_config, None, None, "us-east-1")
+
+
+@pytest.mark.parametrize("jq_query", ['.Tags', '{Tags}', '{engine: .Engine, Tags}', '."Tags"', '.["Tags"]',
+                                      '"\\(.Tags)"', 'first(.Tags[]? | select(.Key == "team") | .Value)'])
+def test_enrichment_is_kept_when_read(jq_query):
+    assert create_handler({"tags": jq_query}).enrichments == {"Tags": "list_tags_for_resource"}
+
+
+@pytest.mark.parametrize("jq_query", ['.Engine', '.Engine | ascii_downcase', '{engine: .Engine}',
+                                      '.Engine // "redis" | length'])
+def test_enrichment_is_skipped_when_not_read(jq_query):
+    assert create_handler({"engine": jq_query}).enrichments == {}
+
+
+@pytest.mark.parametrize("jq_query", ['.', '. + to_entries', '.Engine + tojson', '.Engine // to_entries',
+                                      '.Engine == keys', '.Engine and length', 'to_entries', 'tojson', '..',
+                                      '.[]', '.[.Key]', 'select(.Engine) | .Tags', 'getpath(["Tags"])',
+                                      'has("Tags")', '"\\(.)"', 'def f: .; f', '.Engine as $engine | keys'])
+def test_enrichments_are_kept_when_the_whole_resource_may_be_read(jq_query):
+    assert create_handler({"engine": jq_query}).enrichments == {"Tags": "list_tags_for_resource"}
+    assert get_jq_queries_referenced_keys([jq_query]) is None
+
+
+def test_enrichment_read_by_the_selector_is_kept():
+    assert create_handler({"engine": ".Engine"}, selector_query='.Tags | length > 0').enrichments == {
+        "Tags": "list_tags_for_resource"}
+
+
+def test_enrichments_are_kept_without_lazy_enrichment():
+    handler = create_handler({"engine": ".Engine"})
+    handler.selector_aws["lazy_enrichment"] = False
+    assert handler._get_required_enrichments() == {"Tags": "list_tags_for_resource"}
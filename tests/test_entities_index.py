@@ -0,0 +1,36 @@
+import json
+
+EC2_EVENT = {"resource_type": "AWS::EC2::Instance", "region": '"us-east-1"', "identifier": '"i-00000004"'}
+
+
+def get_event(**event):
+    return {"Records": [{"messageId": "message-1", "body": json.dumps({**EC2_EVENT, **event})}]}
+
+
+def test_unchanged_entities_are_skipped(exporter, fake_aws, fake_port):
+    exporter.sync()
+    fake_port.calls.clear()
+    exporter.sync()
+
+    assert fake_port.calls["bulk_upsert"] == 0 and fake_port.calls["upsert"] == 0
+    assert set(fake_port.entities) == fake_aws.expected_entities()
+
+
+def test_changes_are_compacted_into_the_index(exporter, fake_aws):
+    exporter.sync()
+    exporter.sync()
+
+    assert "config/entities_index.json.gz" in fake_aws.s3
+    assert not [key for key in fake_aws.s3 if key.startswith("config/entities_index_changes/")]
+
+
+def test_entity_deleted_by_an_event_is_upserted_when_its_resource_is_back(exporter, fake_aws, fake_port):
+    exporter.sync()
+    fake_aws.counts["ec2"] = 4
+    assert exporter.invoke(get_event(action='"delete"')) == {"batchItemFailures": []}
+    assert ("ec2Instance", "i-00000004") not in fake_port.entities
+
+    fake_aws.counts["ec2"] = 5
+    exporter.sync()
+
+    assert set(fake_port.entities) == fake_aws.expected_entities()
@@ -0,0 +1,56 @@
+import json
+
+import pytest
+from fake_aws import FakeAWSError
+
+EC2_EVENT = {"resource_type": "AWS::EC2::Instance", "region": '"us-east-1"', "identifier": ".detail.instance_id"}
+ACM_EVENT = {"resource_type": "AWS::ACM::Certificate", "region": '"us-east-1"', "identifier": ".detail.arn"}
+
+
+def get_event(*bodies):
+    return {"Records": [{"messageId": f"message-{i}", "body": body if isinstance(body, str) else json.dumps(body)}
+                        for i, body in enumerate(bodies)]}
+
+
+@pytest.fixture
+def certificate_arns(fake_aws, monkeypatch):
+    # The first certificate was deleted, the second can't be read, and the third fails to be described
+    arns = [fake_aws._certificate_arn(k) for k in range(3)]
+    describe_certificate = fake_aws._acm_DescribeCertificate
+    errors = {arns[0]: FakeAWSError(400, "ResourceNotFoundException", "Could not find certificate"),
+              arns[1]: FakeAWSError(400, "AccessDeniedException", "Not authorized to describe the certificate"),
+              arns[2]: FakeAWSError(400, "InvalidStateException", "Certificate is being updated")}
+
+    def describe_failing_certificate(params):
+        if params["CertificateArn"] in errors:
+            raise errors[params["CertificateArn"]]
+        return describe_certificate(params)
+
+    monkeypatch.setattr(fake_aws, "_acm_DescribeCertificate", describe_failing_certificate)
+    return arns
+
+
+def test_events_of_a_batch_are_handled(exporter, fake_port):
+    response = exporter.invoke(get_event(*[{**EC2_EVENT, "detail": {"instance_id": f"i-{k:08d}"}} for k in range(3)]))
+
+    assert response == {"batchItemFailures": []}
+    assert set(fake_port.entities) == {("ec2Instance", f"i-{k:08d}") for k in range(3)}
+
+
+def test_malformed_events_are_not_returned_to_the_queue(exporter, fake_port):
+    response = exporter.invoke(get_event("not json", {**EC2_EVENT, "detail": {}},
+                                         {**EC2_EVENT, "detail": {"instance_id": 1}},
+                                         {key: value for key, value in EC2_EVENT.items() if key != "region"},
+                                         {**EC2_EVENT, "detail": {"instance_id": "i-00000001"}}))
+
+    assert response == {"batchItemFailures": []}
+    assert set(fake_port.entities) == {("ec2Instance", "i-00000001")}
+
+
+def test_only_events_that_may_succeed_are_returned_to_the_queue(exporter, fake_port, certificate_arns):
+    fake_port.entities[("acmCertificate", certificate_arns[0])] = {}
+    response = exporter.invoke(get_event(*[{**ACM_EVENT, "detail": {"arn": arn}} for arn in certificate_arns]))
+
+    # Deleted certificates are deleted from Port, and events of certificates that can't be read are dropped
+    assert response == {"batchItemFailures": [{"itemIdentifier": "message-2"}]}
+    assert fake_port.entities == {}
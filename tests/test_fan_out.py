@@ -0,0 +1,57 @@
+import json
+
+from conftest import CONFIG
+
+FAN_OUT_CONFIG = {**CONFIG, "fan_out": {"enabled": True, "max_parallel_shards": 1}}
+FAN_OUT_PREFIX = "config/fan_out"
+
+
+def start_run(exporter, fake_aws):
+    # The scheduled invocation starts the run, and invokes its lanes
+    exporter.set_config(FAN_OUT_CONFIG)
+    exporter.invoke()
+    return json.loads(fake_aws.s3[f"{FAN_OUT_PREFIX}/current.json"])["run_id"]
+
+
+def complete_run(exporter, fake_aws):
+    while fake_aws.invocations:
+        exporter.invoke(fake_aws.invocations.pop(0))
+
+
+def test_fanned_out_sync(exporter, fake_aws, fake_port):
+    fake_port.entities[("ec2Instance", "stale-1")] = {}
+    start_run(exporter, fake_aws)
+    assert len(fake_aws.invocations) == 1
+    complete_run(exporter, fake_aws)
+
+    assert set(fake_port.entities) == fake_aws.expected_entities()
+    assert not [key for key in fake_aws.s3 if key.startswith(f"{FAN_OUT_PREFIX}/")]
+
+
+def test_shards_are_synced_with_the_config_of_their_run(exporter, fake_aws, fake_port):
+    start_run(exporter, fake_aws)
+    exporter.set_config({**FAN_OUT_CONFIG, "resources": CONFIG["resources"][1:]})
+    complete_run(exporter, fake_aws)
+
+    assert set(fake_port.entities) == fake_aws.expected_entities()
+
+
+def test_timed_out_shard_is_taken_over(exporter, fake_aws, fake_port, caplog):
+    run_id = start_run(exporter, fake_aws)
+    # Claimed by a lane that stopped without a heartbeat since
+    fake_aws.s3[f"{FAN_OUT_PREFIX}/{run_id}/shards/0/claim-001-lost"] = b""
+    complete_run(exporter, fake_aws)
+
+    assert f"Shard: 0 of fanned out sync: {run_id} timed out, syncing it again" in caplog.text
+    assert set(fake_port.entities) == fake_aws.expected_entities()
+
+
+def test_timed_out_finalization_is_taken_over(exporter, fake_aws, fake_port, caplog):
+    fake_port.entities[("ec2Instance", "stale-1")] = {}
+    run_id = start_run(exporter, fake_aws)
+    fake_aws.s3[f"{FAN_OUT_PREFIX}/{run_id}/finalization/claim-001-lost"] = b""
+    complete_run(exporter, fake_aws)
+
+    assert f"Stale entities deletion of fanned out sync: {run_id} timed out, taking it over" in caplog.text
+    assert set(fake_port.entities) == fake_aws.expected_entities()
+    assert not [key for key in fake_aws.s3 if key.startswith(f"{FAN_OUT_PREFIX}/")]
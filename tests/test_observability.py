@@ -0,0 +1,54 @@
+import io
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import consts
+from observability import MetricsLogger
+
+THREADS = 8
+PUTS_PER_THREAD = 3000
+
+
+def test_lines_printed_by_threads_are_valid_json(tmp_path, monkeypatch):
+    # Unbuffered like the Lambda stdout, where every write goes to the file at once
+    output_file = io.TextIOWrapper(open(tmp_path / "stdout", "wb", buffering=0), write_through=True)
+    monkeypatch.setattr("sys.stdout", output_file)
+    # A line per value and frequent thread switches, so threads print concurrently as often as possible
+    monkeypatch.setattr(consts, "METRICS_MAX_VALUES_PER_LINE", 1)
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    metrics = MetricsLogger()
+    metrics.set_default_dimensions(FunctionName="port-aws-exporter")
+
+    def put_values(thread_index):
+        for i in range(PUTS_PER_THREAD):
+            metrics.put("Latency", i, Thread=thread_index)
+            metrics.increment("Requests", Thread=thread_index)
+
+    try:
+        with ThreadPoolExecutor(max_workers=THREADS) as executor:
+            list(executor.map(put_values, range(THREADS)))
+    finally:
+        sys.setswitchinterval(switch_interval)
+    metrics.flush()
+    output_file.close()
+
+    lines = (tmp_path / "stdout").read_text().splitlines()
+    parsed_lines = [json.loads(line) for line in lines]
+    latency_values = [value for line in parsed_lines if "Latency" in line
+                      for value in (line["Latency"] if isinstance(line["Latency"], list) else [line["Latency"]])]
+    assert len(latency_values) == THREADS * PUTS_PER_THREAD
+    assert sum(line.get("Requests", 0) for line in parsed_lines) == THREADS * PUTS_PER_THREAD
+
+
+def test_line_format(capsys):
+    metrics = MetricsLogger(namespace="Test")
+    metrics.set_default_dimensions(FunctionName="port-aws-exporter")
+    metrics.put("StageDuration", 12.3456, Stage="upsert")
+    metrics.flush()
+
+    line = json.loads(capsys.readouterr().out)
+    assert line["_aws"]["CloudWatchMetrics"] == [{"Namespace": "Test", "Dimensions": [["FunctionName", "Stage"]],
+                                                  "Metrics": [{"Name": "StageDuration", "Unit": "Milliseconds"}]}]
+    assert (line["FunctionName"], line["Stage"], line["StageDuration"]) == ("port-aws-exporter", "upsert", 12.346)
@@ -0,0 +1,55 @@
+import threading
+
+import pytest
+
+from aws.resources.pipeline import ResourcesPipeline
+
+
+class Handler:
+    kind = "AWS::Test::Resource"
+    selector_query = "true"
+    mappings = [{"identifier": ".Id", "blueprint": '"testResource"', "properties": {"size": ".Size | keys"}}]
+
+    def fetch_resource(self, region, resource_id, action_type="upsert", resource_obj=None):
+        if resource_id == "unreachable":
+            raise RuntimeError("Failed to describe the resource")
+        return {"Id": resource_id, "Size": "large" if resource_id == "invalid" else {"GiB": 8}}
+
+
+class EntitiesWriter:
+    def __init__(self):
+        self.entities = []
+        self._lock = threading.Lock()
+
+    def write(self, entities, action_type="upsert"):
+        with self._lock:
+            self.entities.extend(entities)
+        return {f"{entity['blueprint']};{entity['identifier']}" for entity in entities}
+
+
+@pytest.fixture
+def pipeline():
+    pipeline = ResourcesPipeline(EntitiesWriter(), fetch_workers=2, transform_workers=2, write_workers=2,
+                                 queue_size=2)
+    yield pipeline
+    pipeline.close()
+
+
+def test_resources_go_through_all_the_stages(pipeline):
+    futures = [pipeline.submit(Handler(), "us-east-1", f"resource-{k}") for k in range(20)]
+
+    assert [future.result() for future in futures] == [
+        {"aws_entities": {f"testResource;resource-{k}"}, "skip_delete": False} for k in range(20)]
+    assert sorted(entity["identifier"] for entity in pipeline.entities_writer.entities) == sorted(
+        f"resource-{k}" for k in range(20))
+
+
+@pytest.mark.parametrize("resource_id", ["unreachable", "invalid"])
+def test_failed_resources_skip_the_stale_entities_deletion(pipeline, resource_id):
+    failed_future = pipeline.submit(Handler(), "us-east-1", resource_id)
+    future = pipeline.submit(Handler(), "us-east-1", "resource-1")
+
+    failed_result = failed_future.result()
+    assert failed_result["aws_entities"] == set() and failed_result["skip_delete"] and failed_result["error"]
+    assert future.result() == {"aws_entities": {"testResource;resource-1"}, "skip_delete": False}
+    assert [entity["identifier"] for entity in pipeline.entities_writer.entities] == ["resource-1"]
@@ -0,0 +1,23 @@
+import consts
+from aws import rate_limiter
+from aws.rate_limiter import AdaptiveRateLimiter, get_rate_limiter
+
+
+def test_limiters_start_at_the_quota_of_their_service(monkeypatch):
+    monkeypatch.setattr(rate_limiter, "_rate_limiters", {})
+
+    assert get_rate_limiter("ec2", "us-east-1").rate == consts.AWS_RATE_LIMIT_INITIAL_RATES["ec2"]
+    assert get_rate_limiter("elasticache", "us-east-1").rate == consts.AWS_RATE_LIMIT_INITIAL_RATE
+    assert get_rate_limiter("ec2", "us-east-1") is get_rate_limiter("ec2", "us-east-1")
+    assert get_rate_limiter("ec2", "us-east-1") is not get_rate_limiter("ec2", "eu-west-1")
+
+
+def test_rate_is_halved_once_per_throttling_burst():
+    limiter = AdaptiveRateLimiter("ec2 in us-east-1", initial_rate=20.0, min_rate=0.5, max_rate=100.0)
+    limiter.on_throttle()
+    limiter.on_throttle()
+    assert limiter.rate == 10.0
+
+    for _ in range(10):
+        limiter.on_success()
+    assert 10.0 < limiter.rate < 12.0
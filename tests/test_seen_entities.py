@@ -0,0 +1,23 @@
+import gzip
+import json
+
+
+def test_seen_entities_are_checkpointed_as_hashes(exporter, fake_aws, short_invocations):
+    exporter.invoke()
+    checkpoint_key = fake_aws.invocations[0]["next_config_file_key"]
+    checkpoint = json.loads(fake_aws.s3[checkpoint_key])
+    chunk = json.loads(gzip.decompress(fake_aws.s3[checkpoint["seen_entities_chunks"][0]]))
+
+    assert "aws_entities" not in checkpoint
+    assert {blueprint: len(identifiers_hashes) for blueprint, identifiers_hashes in chunk.items()} == {
+        "ec2Instance": 2, "acmCertificate": 2}
+    assert all(isinstance(identifier_hash, int) for identifiers_hashes in chunk.values()
+               for identifier_hash in identifiers_hashes)
+
+
+def test_entities_seen_by_every_invocation_are_kept(exporter, fake_aws, fake_port, short_invocations):
+    fake_port.entities[("ec2Instance", "stale-1")] = {}
+    assert exporter.sync() == 2
+
+    assert set(fake_port.entities) == fake_aws.expected_entities()
+    assert not [key for key in fake_aws.s3 if "/seen_entities/" in key]
@@ -0,0 +1,44 @@
+import json
+
+import consts
+
+MAPPED_BLUEPRINTS_KEY = "config/mapped_blueprints.json"
+
+
+def test_stale_entities_are_deleted_page_by_page(exporter, fake_port, monkeypatch):
+    exporter.sync()  # Searches all the entities of the exporter at once, as it has no blueprints of previous runs
+    monkeypatch.setattr(consts, "PORT_SEARCH_PAGE_SIZE", 2)
+    fake_port.entities.update({("ec2Instance", f"stale-{k}"): {} for k in range(5)})
+    fake_port.calls.clear()
+    exporter.sync()
+
+    assert set(fake_port.entities) == exporter.fake_aws.expected_entities()
+    assert fake_port.calls["blueprint_search"] > len(exporter.config["resources"])
+
+
+def test_entities_of_kinds_removed_from_the_config_are_deleted(exporter, fake_aws, fake_port):
+    exporter.sync()
+    assert json.loads(fake_aws.s3[MAPPED_BLUEPRINTS_KEY]) == ["acmCertificate", "ec2Instance"]
+
+    exporter.set_config({"resources": exporter.config["resources"][:1]})
+    exporter.sync()
+    assert {blueprint for blueprint, _ in fake_port.entities} == {"ec2Instance"}
+    # Kept until a run finds none of its entities left
+    assert json.loads(fake_aws.s3[MAPPED_BLUEPRINTS_KEY]) == ["acmCertificate", "ec2Instance"]
+
+    exporter.sync()
+    assert json.loads(fake_aws.s3[MAPPED_BLUEPRINTS_KEY]) == ["ec2Instance"]
+
+
+def test_blueprints_deleted_from_port_are_skipped(exporter, fake_aws, fake_port):
+    exporter.sync()
+    exporter.set_config({"resources": exporter.config["resources"][:1]})
+    fake_port.deleted_blueprints.add("acmCertificate")
+    fake_port.entities = {entity: body for entity, body in fake_port.entities.items() if entity[0] != "acmCertificate"}
+    fake_port.entities[("ec2Instance", "stale-0")] = {}
+
+    exporter.sync()
+    assert ("ec2Instance", "stale-0") not in fake_port.entities
+    assert json.loads(fake_aws.s3[MAPPED_BLUEPRINTS_KEY]) == ["ec2Instance"]
+    # The rest of the sync still ran, its checkpoint and index changes were cleaned up
+    assert not [key for key in fake_aws.s3 if "/seen_entities/" in key or "entities_index_changes/" in key]
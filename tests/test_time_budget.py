@@ -0,0 +1,57 @@
+import json
+from collections import Counter
+
+from aws.resources.pipeline import ResourcesPipeline
+from aws.resources.time_budget import TimeBudget
+from conftest import LambdaContext
+
+
+def get_ec2_regions_config(fake_aws):
+    checkpoint = json.loads(fake_aws.s3[fake_aws.invocations[0]["next_config_file_key"]])
+    return checkpoint["resources"][0]["selector"]["aws"]["regions_config"]["us-east-1"]
+
+
+def test_budget_estimates_follow_the_observed_timings():
+    time_budget = TimeBudget(LambdaContext(timeout_ms=60 * 1000), margin_ms=10 * 1000)
+    time_budget.item_ms = 1000
+    affordable_items = time_budget.get_affordable_items()
+    assert 0 < affordable_items <= 50
+
+    for _ in range(20):
+        time_budget.record_items(100, 1000)
+    assert time_budget.get_affordable_items() > 10 * affordable_items
+    assert time_budget.has_time_for_page()
+    assert not TimeBudget(LambdaContext(timeout_ms=60 * 1000), margin_ms=60 * 1000).has_time_for_page()
+
+
+def test_sync_resumes_mid_page(exporter, fake_aws, fake_port, short_invocations, monkeypatch):
+    submitted = Counter()
+    submit = ResourcesPipeline.submit
+
+    def count_submit(pipeline, handler, region, resource_id, *args, **kwargs):
+        submitted[resource_id] += 1
+        return submit(pipeline, handler, region, resource_id, *args, **kwargs)
+
+    monkeypatch.setattr(ResourcesPipeline, "submit", count_submit)
+    exporter.invoke()
+    assert get_ec2_regions_config(fake_aws)["page_offsets"] == {"": {"offset": 2, "identifier": "i-00000001"}}
+
+    while fake_aws.invocations:
+        exporter.invoke(fake_aws.invocations.pop(0))
+
+    assert set(fake_port.entities) == fake_aws.expected_entities()
+    # The 5 instances and 3 certificates are all on the first page, each of them is handled once
+    assert sorted(submitted.values()) == [1] * 8
+
+
+def test_changed_page_is_handled_from_the_start(exporter, fake_aws, fake_port, short_invocations, caplog):
+    exporter.invoke()
+    fake_aws.counts["ec2"] = 1
+    while fake_aws.invocations:
+        exporter.invoke(fake_aws.invocations.pop(0))
+
+    assert "Page of kind: AWS::EC2::Instance, region: us-east-1 changed since it was checkpointed" in caplog.text
+    # Instances seen by an earlier invocation of the sync are kept, until the next sync
+    assert set(fake_port.entities) == fake_aws.expected_entities() | {("ec2Instance", "i-00000001")}
+    exporter.sync()
+    assert set(fake_port.entities) == fake_aws.expected_entities()